@@ -1,44 +1,130 @@
 # coding: utf-8
 
-from parser import *
+from representation import *
+from gml import load_physical, load_request
 import os
+import multiprocessing
 from itertools import product
 from time import time
+from collections import Counter
 
-def start(p, sol=None, best_cost=0):
+def start(p, sol=None, best_cost=0, stats=None, incumbent=None, table=None):
+    """Depth first branch and bound over p.expand()
+
+    A subtree is cut as soon as a request node has no host left or
+    p.bound() cannot beat best_cost. If stats is a Counter it counts the
+    expanded, infeasible, pruned and leaf states. incumbent is an optional
+    shared multiprocessing.Value with the best cost found by any process;
+    it is used for pruning and updated with the solutions found here.
+    table is an optional TranspositionTable, the states whose key is in it
+    are not expanded again and are counted as transpositions.
+    """
+    if stats is None:
+        stats = Counter()
+    bar = best_cost if incumbent is None else max(best_cost, incumbent.value)
     finish = p.is_assigned()
     if finish:
+        stats["leaves"] += 1
         ct = p.cost()
-        if ct > best_cost:
-            sol, best_cost = p, ct
+        if ct > bar:
+            # p is modified in place by the search, so keep a snapshot
+            sol, best_cost = p.solution(), ct
+            if incumbent is not None:
+                with incumbent.get_lock():
+                    incumbent.value = max(incumbent.value, ct)
+    elif not p.feasible():
+        stats["infeasible"] += 1
+    elif p.bound() <= bar:
+        stats["pruned"] += 1
+    elif table is not None and table.seen(p.state_key()):
+        stats["transpositions"] += 1
     else:
+        stats["expanded"] += 1
         for ap in p.expand():
-            sol1, ct = start(ap, sol, best_cost)
+            sol1, ct = start(ap, sol, best_cost, stats, incumbent, table)
             if ct > best_cost:
                 sol, best_cost= sol1, ct
     return sol, best_cost
 
 
+def subproblems(p, depth, moves=()):
+    """Yields the moves that lead to every state of the tree at depth, or
+    to a leaf or dead end above it"""
+    if depth == 0 or p.is_assigned() or not p.feasible():
+        yield moves
+        return
+    for move in p.moves():
+        mark = p.mark()
+        p.apply(move)
+        try:
+            yield from subproblems(p, depth - 1, moves + (move,))
+        finally:
+            p.undo(mark)
+
+
+_worker = dict()
+
+
+def _init_worker(physical, requests, order, incumbent, table_size):
+    # Every process builds the root state once and replays the subproblems
+    _worker["p"] = BranchAndBound(physical, requests, order)
+    _worker["incumbent"] = incumbent
+    _worker["table"] = (None if table_size is None
+                        else TranspositionTable(table_size))
+
+
+def _solve(moves):
+    p = _worker["p"]
+    mark = p.mark()
+    stats = Counter()
+    try:
+        for move in moves:
+            p.apply(move)
+        sol, ct = start(p, None, 0, stats, _worker["incumbent"],
+                        _worker["table"])
+    finally:
+        p.undo(mark)
+    return sol, ct, stats
+
+
+def parallel_start(physical, requests, depth=2, processes=None, order="id",
+                   sol=None, best_cost=0, stats=None, table_size=None):
+    """Same search as start() on BranchAndBound(physical, requests, order)
+
+    The tree is split at depth and the subproblems are handed to a pool
+    of processes one at a time, so idle workers take the next one. The
+    best cost is shared between the workers, so all of them prune
+    against the global incumbent. With table_size, every process keeps
+    a TranspositionTable of that size for the subproblems it solves.
+    """
+    if stats is None:
+        stats = Counter()
+    tasks = list(subproblems(BranchAndBound(physical, requests, order), depth))
+    incumbent = multiprocessing.Value("d", best_cost)
+    with multiprocessing.Pool(processes, _init_worker,
+                              (physical, requests, order, incumbent,
+                               table_size)) as pool:
+        for sol1, ct, st in pool.imap_unordered(_solve, tasks):
+            stats.update(st)
+            if sol1 is not None and ct > best_cost:
+                sol, best_cost = sol1, ct
+    return sol, best_cost
+
+
 
 if __name__ == '__main__':
     DIR = "../instances"
     for net, req in product(os.walk(f"{DIR}/networks/small"), os.walk(f"{DIR}/requests/small")):
         root_net, dir_net, files_net = net
-        root_req, dir_req, files_req = net
+        root_req, dir_req, files_req = req
         files_req = [name for name in files_req if name.endswith((".gml",))]
         files_net = [name for name in files_net if name.endswith((".gml",))]
         for name_req, name_net in product(files_req, files_net):
-            f = open(os.path.join(root_net, name_net), 'r')
-            in_ = f.read()
-            lexer, parser = FuncSplitLexer(), PhysicalParser()
-            parser.shift = 0
-            j0 = parser.parse(lexer.tokenize(in_))
-            f = open(os.path.join(root_req, name_req), 'r')
-            in_ = f.read()
-            lexer, parser = FuncSplitLexer(), RequestParser()
-            parser.shift = 0
-            j1 = parser.parse(lexer.tokenize(in_))
+            j0 = load_physical(os.path.join(root_net, name_net))
+            j1 = load_request(os.path.join(root_req, name_req))
             temp = time()
             bb = BranchAndBound(j0, j1)
-            start(bb)
-            print(f'|{name_req}|{name_net}|{time() - temp}|')
+            stats = Counter()
+            start(bb, stats=stats)
+            print(f'|{name_req}|{name_net}|{time() - temp}|'
+                  f'{stats["expanded"]}|{stats["pruned"]}|{stats["leaves"]}|')
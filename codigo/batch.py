@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Runs the solver over the grid of network and request instances
+
+Every pair is solved in a pool of processes with a time limit and the
+result is appended to the output file (JSON lines, or CSV if the name
+ends with .csv) as soon as it is known. Pairs already in the output file
+are skipped, so a sweep that stopped can be started again with the same
+arguments.
+
+The time limit is cooperative and only covers the search: parsing,
+building the BranchAndBound and the warm start always run to the end,
+and the search gets the seconds of the limit that are left.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+from collections import Counter
+from itertools import product
+from time import time
+
+from BB import *
+import cache
+from heuristic import warm_start
+from search import Search
+
+FIELDS = ["network", "request", "status", "cost", "time",
+          "expanded", "leaves", "pruned", "infeasible"]
+
+
+def gml_files(directory):
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".gml"):
+                yield os.path.join(root, name)
+
+
+def instance_pairs(directory, tiers):
+    """Pairs every network with every request of the same tier, as paths
+    relative to directory"""
+    pairs = []
+    for tier in tiers:
+        networks = sorted(gml_files(os.path.join(directory, "networks", tier)))
+        requests = sorted(gml_files(os.path.join(directory, "requests", tier)))
+        for net, req in product(networks, requests):
+            pairs.append((os.path.relpath(net, directory),
+                          os.path.relpath(req, directory)))
+    return pairs
+
+
+def run_instance(task):
+    directory, net, req, timeout, cache_dir, warm = task
+    result = dict(network=net, request=req, status="ok", cost=None)
+    stats = Counter()
+    temp = time()
+    try:
+        if cache_dir:
+            j0 = cache.load_physical(os.path.join(directory, net),
+                                     cache_dir=cache_dir)
+            j1 = cache.load_request(os.path.join(directory, req),
+                                    cache_dir=cache_dir)
+        else:
+            j0 = load_physical(os.path.join(directory, net))
+            j1 = load_request(os.path.join(directory, req))
+        p = BranchAndBound(j0, j1)
+        sol, cost = warm_start(p) if warm else (None, 0)
+        search = Search(p, sol, cost, stats)
+        left = None if timeout is None else timeout - (time() - temp)
+        sol, cost = search.run(max_time=left)
+        result["cost"] = cost if sol is not None else None
+        if not search.done:
+            # The cost is the best one found before the time limit
+            result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = f"error: {e!r}"
+    result["time"] = time() - temp
+    for key in ("expanded", "leaves", "pruned", "infeasible"):
+        result[key] = stats[key]
+    return result
+
+
+def drop_partial(output):
+    """Truncates output after its last complete line, since a crash can
+    leave the last one half written and the next run would append to it"""
+    if not os.path.exists(output):
+        return
+    with open(output, "r+b") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def finished(output):
+    """Pairs that already have a result in output"""
+    if not os.path.exists(output):
+        return set()
+    with open(output, newline="") as f:
+        if output.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return {(row["network"], row["request"]) for row in rows}
+
+
+def run(directory, tiers, output, timeout=None, processes=None,
+        cache_dir=cache.CACHE_DIR, warm=False):
+    drop_partial(output)
+    done = finished(output)
+    tasks = [(directory, net, req, timeout, cache_dir, warm)
+             for net, req in instance_pairs(directory, tiers)
+             if (net, req) not in done]
+    is_csv = output.endswith(".csv")
+    with open(output, "a", newline="") as f, \
+            multiprocessing.Pool(processes) as pool:
+        if is_csv:
+            writer = csv.DictWriter(f, FIELDS)
+            if f.tell() == 0:
+                writer.writeheader()
+        for result in pool.imap_unordered(run_instance, tasks):
+            if is_csv:
+                writer.writerow(result)
+            else:
+                f.write(json.dumps(result) + "\n")
+            f.flush()
+            print(f'|{result["request"]}|{result["network"]}|'
+                  f'{result["status"]}|{result["time"]}|')
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--dir", default="../instances")
+    args.add_argument("--tiers", nargs="+", default=["small"],
+                      choices=["small", "medium", "large"])
+    args.add_argument("--output", default="results.jsonl")
+    args.add_argument("--timeout", type=float, default=None,
+                      help="seconds per instance, checked only by the "
+                           "search, which gets what parsing and setup left")
+    args.add_argument("--processes", type=int, default=None)
+    args.add_argument("--cache-dir", default=cache.CACHE_DIR,
+                      help="parsed instances, empty to parse every time")
+    args.add_argument("--warm-start", action="store_true",
+                      help="seed the incumbent with the greedy heuristic")
+    args = args.parse_args()
+    run(args.dir, args.tiers, args.output, args.timeout, args.processes,
+        args.cache_dir, args.warm_start)
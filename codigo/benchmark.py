@@ -0,0 +1,194 @@
+# coding: utf-8
+"""Benchmark of the loader and the search over the instance tiers
+
+The suite takes the same network/request pairs every time: for every
+tier, `count` networks and `count` requests evenly spaced in the sorted
+file lists, paired in order, plus the madrid instances. Every pair runs
+in a new process, which loads the files, builds the BranchAndBound and
+searches depth first for at most `budget` states, timing the three steps
+separately. After `warmup` runs that are not kept, the best time of
+`repeats` runs, the least disturbed by the rest of the machine, is
+reported with the states per second of the search and the peak resident
+memory of the process.
+
+With a baseline file, the results are compared with it and the steps
+that got slower than `tolerance` (and more than NOISE), a peak memory
+that grew more than `memory_tolerance` (and more than MEMORY_NOISE) or a
+search that ends with another cost are reported as regressions.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+from collections import Counter
+from time import perf_counter
+
+from representation import *
+from gml import load_physical, load_request
+from search import Search
+from batch import gml_files
+from distances import DistanceMatrix
+
+DIR = "../instances"
+TIERS = ["small", "medium", "large"]
+STEPS = ["parse", "setup", "search"]
+NOISE = 0.001  # Seconds of difference that are never a regression
+MEMORY_NOISE = 1024  # Kilobytes of difference that are never a regression
+# Madrid uses its own format, read by parser2.py, and has no search yet;
+# its setup is the computation of the distance matrix of the network
+MADRID = [("madrid/madridTiny.gml", "madrid/requestTiny.gml"),
+          ("madrid/madridSmall.gml", "madrid/requestTiny.gml"),
+          ("madrid/madridMedium.gml", "madrid/requestTiny.gml"),
+          ("madrid/madridReal.gml", "madrid/requestTiny.gml")]
+
+
+def spread(items, count):
+    """count items evenly spaced in items, with the first and the last"""
+    if len(items) <= count:
+        return items
+    if count == 1:
+        return items[:1]
+    return [items[i * (len(items) - 1) // (count - 1)] for i in range(count)]
+
+
+def suite(directory=DIR, tiers=TIERS, count=3, madrid=True):
+    """(tier, network, request) of the pairs of the benchmark, with paths
+    relative to directory"""
+    pairs = []
+    for tier in tiers:
+        networks = sorted(gml_files(os.path.join(directory, "networks", tier)))
+        requests = sorted(gml_files(os.path.join(directory, "requests", tier)))
+        networks, requests = spread(networks, count), spread(requests, count)
+        for net, req in zip(networks, requests):
+            pairs.append((tier, os.path.relpath(net, directory),
+                          os.path.relpath(req, directory)))
+    if madrid:
+        pairs += [("madrid", net, req) for net, req in MADRID]
+    return pairs
+
+
+def run_once(directory, tier, net, req, budget):
+    """Times of the steps, the cost and the states expanded of one run"""
+    times = dict()
+    temp = perf_counter()
+    if tier == "madrid":
+        from parser2 import FuncSplitLexer, PhysicalParser, RequestParser
+        graphs = []
+        for path, parser in ((net, PhysicalParser), (req, RequestParser)):
+            with open(os.path.join(directory, path)) as f:
+                graphs.append(parser().parse(FuncSplitLexer().tokenize(f.read())))
+        times["parse"] = perf_counter() - temp
+        temp = perf_counter()
+        DistanceMatrix.from_topology(graphs[0])
+        times["setup"] = perf_counter() - temp
+        return times, None, 0
+    j0 = load_physical(os.path.join(directory, net))
+    j1 = load_request(os.path.join(directory, req))
+    times["parse"] = perf_counter() - temp
+    temp = perf_counter()
+    p = BranchAndBound(j0, j1)
+    times["setup"] = perf_counter() - temp
+    temp = perf_counter()
+    stats = Counter()
+    sol, cost = Search(p, stats=stats).run(max_nodes=budget)
+    times["search"] = perf_counter() - temp
+    return times, (cost if sol is not None else None), stats["expanded"]
+
+
+def run_pair(task):
+    directory, tier, net, req, budget, warmup, repeats = task
+    for _ in range(warmup):
+        run_once(directory, tier, net, req, budget)
+    runs = [run_once(directory, tier, net, req, budget)
+            for _ in range(repeats)]
+    result = dict(tier=tier, network=net, request=req)
+    for step in STEPS:
+        values = [times[step] for times, cost, expanded in runs
+                  if step in times]
+        result[step] = min(values) if values else None
+    # The states per second of the run with the fastest search, so both
+    # numbers come from the same run
+    times, result["cost"], result["expanded"] = min(
+        runs, key=lambda run: run[0].get("search", 0))
+    if times.get("search"):
+        result["nodes_per_sec"] = result["expanded"] / times["search"]
+    else:
+        result["nodes_per_sec"] = None
+    # Kilobytes on Linux, the process only ran this pair
+    result["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run(pairs, directory=DIR, budget=2000, warmup=1, repeats=3):
+    tasks = [(directory, tier, net, req, budget, warmup, repeats)
+             for tier, net, req in pairs]
+    # A new process per pair, so the peak memory is the one of the pair
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        return list(pool.imap(run_pair, tasks))
+
+
+def compare(results, baseline, tolerance=0.25, memory_tolerance=0.1):
+    """Regressions of results with respect to baseline, as text lines"""
+    old = {(entry["network"], entry["request"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        key = (entry["network"], entry["request"])
+        if key not in old:
+            continue
+        for step in STEPS:
+            before, now = old[key].get(step), entry.get(step)
+            if (before and now and now > before * (1 + tolerance)
+                    and now - before > NOISE):
+                regressions.append(f"{key[0]} {key[1]}: {step} "
+                                   f"{before:.4f}s -> {now:.4f}s")
+        before, now = old[key].get("peak_rss"), entry.get("peak_rss")
+        if (before and now and now > before * (1 + memory_tolerance)
+                and now - before > MEMORY_NOISE):
+            regressions.append(f"{key[0]} {key[1]}: peak_rss "
+                               f"{before}KB -> {now}KB")
+        if old[key].get("cost") != entry.get("cost"):
+            regressions.append(f"{key[0]} {key[1]}: cost "
+                               f"{old[key].get('cost')} -> {entry.get('cost')}")
+    return regressions
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("--dir", default=DIR)
+    args.add_argument("--tiers", nargs="+", default=TIERS)
+    args.add_argument("--count", type=int, default=3,
+                      help="pairs of every tier")
+    args.add_argument("--no-madrid", action="store_true")
+    args.add_argument("--budget", type=int, default=2000,
+                      help="states searched in every pair")
+    args.add_argument("--warmup", type=int, default=1)
+    args.add_argument("--repeats", type=int, default=3)
+    args.add_argument("--output", default=None,
+                      help="JSON file for the results, to use as baseline")
+    args.add_argument("--baseline", default=None,
+                      help="JSON file of an earlier run to compare with")
+    args.add_argument("--tolerance", type=float, default=0.25,
+                      help="slowdown allowed before a step is a regression")
+    args.add_argument("--memory-tolerance", type=float, default=0.1,
+                      help="growth of the peak memory allowed before it is "
+                           "a regression")
+    args = args.parse_args()
+    pairs = suite(args.dir, args.tiers, args.count, not args.no_madrid)
+    results = run(pairs, args.dir, args.budget, args.warmup, args.repeats)
+    for entry in results:
+        print('|' + '|'.join(str(entry[name]) for name in
+                             ["tier", "network", "request"] + STEPS +
+                             ["cost", "expanded", "nodes_per_sec",
+                              "peak_rss"]) + '|')
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance,
+                                  args.memory_tolerance)
+        for line in regressions:
+            print(f'regression: {line}')
+        sys.exit(1 if regressions else 0)
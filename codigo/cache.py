@@ -0,0 +1,186 @@
+# coding: utf-8
+"""Binary cache of parsed instances
+
+A parsed Topology is stored as columns of numbers (array typecodes 'q' or
+'d') plus a blob with the labels, behind a small JSON header, written by
+pack() and read by unpack(), which distances.py and splits.py use too.
+The file name is the SHA-256 of the GML text, the kind of graph, the
+shift and the magic of the format, so an instance is parsed once and
+later loads only read the file. It is only a parse cache: every load
+still builds the nodes and edges of the Topology as Python objects.
+"""
+import hashlib
+import json
+import os
+import struct
+from array import array
+from collections import defaultdict
+
+from representation import *
+from gml import parse_physical, parse_request
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                         "cache")
+MAGIC = b"LFC2"
+_HEADER = struct.Struct("<4sI")  # magic, length of the JSON header
+
+# Columns of every kind of graph, the nodes start with the class code:
+# 1 for DistributedUnit and 2 for CentralUnit
+NODE_COLUMNS = ["cls", "id", "x", "y", "prc", "prb", "ant", "theta"]
+EDGE_COLUMNS = {"physical": ["source", "target", "bandwith", "distance", "type"],
+                "request": ["source", "target", "bandwith", "delay"]}
+PARSERS = {"physical": parse_physical, "request": parse_request}
+
+
+def _column(values):
+    if all(isinstance(i, int) for i in values):
+        return array('q', values)
+    return array('d', values)
+
+
+def write(name, data):
+    """Writes data to the file name, creating its folder"""
+    os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+    # Several processes of a sweep can write the same entry
+    temp = f"{name}.{os.getpid()}"
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, name)
+
+
+def pack(magic, header, columns, blob=b""):
+    """magic, header as JSON with the name, typecode and length of every
+    array of the dict columns, the arrays and blob"""
+    header = dict(header, columns=[[name, column.typecode, len(column)]
+                                   for name, column in columns.items()])
+    header = json.dumps(header).encode()
+    # Pad the header so the columns are aligned to 8 bytes
+    header += b" " * (-(_HEADER.size + len(header)) % 8)
+    data = [_HEADER.pack(magic, len(header)), header]
+    data += [column.tobytes() for column in columns.values()]
+    data.append(blob)
+    return b"".join(data)
+
+
+def unpack(buffer, magic):
+    """header, dict of arrays and blob of a buffer written by pack()"""
+    found, size = _HEADER.unpack_from(buffer)
+    if found != magic:
+        raise Exception(f"Not a cached {magic.decode()} file")
+    pos = _HEADER.size + size
+    header = json.loads(bytes(buffer[_HEADER.size:pos]))
+    columns = dict()
+    for name, typecode, length in header.pop("columns"):
+        column = array(typecode)
+        column.frombytes(buffer[pos:pos + column.itemsize * length])
+        columns[name] = column
+        pos += column.itemsize * length
+    return header, columns, buffer[pos:]
+
+
+def dumps(topology, kind):
+    nodes, edges = topology.get_nodes(), topology.get_edges()
+    columns = dict()
+    columns["cls"] = array('q', [1 if isinstance(node, DistributedUnit) else 2
+                                 for node in nodes])
+    for name in NODE_COLUMNS[1:]:
+        columns[name] = _column([getattr(node, name, 0) for node in nodes])
+    header = {"kind": kind, "nodes": len(nodes)}
+    labels = [node.label for node in nodes]
+    if all(isinstance(i, str) for i in labels):
+        blob = "\0".join(labels).encode()
+    elif all(isinstance(i, (int, float)) for i in labels):
+        columns["label"] = _column(labels)
+        blob = b""
+    else:
+        # A node without a string label gets a number, the gml loader
+        # mixes both kinds
+        header["labels"] = "json"
+        blob = json.dumps(labels).encode()
+    for name in EDGE_COLUMNS[kind]:
+        columns["edge_" + name] = _column([getattr(edge, name)
+                                           for edge in edges])
+    return pack(MAGIC, header, columns, blob)
+
+
+def loads(buffer):
+    """Builds the Topology stored in buffer"""
+    header, columns, blob = unpack(buffer, MAGIC)
+    if "label" in columns:
+        labels = columns["label"].tolist()
+    elif header.get("labels") == "json":
+        labels = json.loads(bytes(blob))
+    elif header["nodes"]:
+        labels = bytes(blob).decode().split("\0")
+    else:
+        labels = []
+    elements = defaultdict(list)
+    cls, ids, x, y, prc, prb, ant, theta = (columns[name].tolist()
+                                            for name in NODE_COLUMNS)
+    for i in range(header["nodes"]):
+        if cls[i] == 1:
+            elements['nodes'].append(DistributedUnit(ids[i], labels[i], x[i],
+                                                     y[i], prc[i], prb[i],
+                                                     ant[i], theta[i]))
+        else:
+            elements['nodes'].append(CentralUnit(ids[i], labels[i], x[i],
+                                                 y[i], prc[i]))
+    edge = EdgePhysical if header["kind"] == "physical" else EdgeVirtual
+    fields = [columns["edge_" + name].tolist()
+              for name in EDGE_COLUMNS[header["kind"]]]
+    elements['edges'] = [edge(*values) for values in zip(*fields)]
+    return Topology(elements)
+
+
+def load(path, kind, shift=1, cache_dir=CACHE_DIR):
+    with open(path, 'rb') as f:
+        text = f.read()
+    key = hashlib.sha256(text)
+    key.update(f"\0{kind}\0{shift}\0".encode() + MAGIC)
+    name = os.path.join(cache_dir, key.hexdigest() + ".bin")
+    if os.path.exists(name):
+        with open(name, 'rb') as f:
+            return loads(f.read())
+    topology = PARSERS[kind](text.decode(), shift)
+    write(name, dumps(topology, kind))
+    return topology
+
+
+def load_physical(path, shift=1, cache_dir=CACHE_DIR):
+    return load(path, "physical", shift, cache_dir)
+
+
+def load_request(path, shift=1, cache_dir=CACHE_DIR):
+    return load(path, "request", shift, cache_dir)
+
+
+if __name__ == '__main__':
+    # Loads a sample of instances without and with the cache
+    import sys
+    from dataclasses import astuple
+    from time import perf_counter
+    import gml
+
+    DIR = "../instances"
+    files = gml.sample_files(DIR, int(sys.argv[1]) if len(sys.argv) > 1
+                             else 50)
+    timings = defaultdict(float)
+    for step in ("gml", "cold", "warm"):
+        for kind, path in files:
+            temp = perf_counter()
+            if step == "gml":
+                (gml.load_physical if kind == "networks"
+                 else gml.load_request)(path, 3)
+            else:
+                (load_physical if kind == "networks" else load_request)(path, 3)
+            timings[step] += perf_counter() - temp
+    for kind, path in files:
+        a = (gml.load_physical if kind == "networks" else gml.load_request)(path, 3)
+        b = (load_physical if kind == "networks" else load_request)(path, 3)
+        for attr in ("get_nodes", "get_edges"):
+            if ([astuple(i) for i in getattr(a, attr)()] !=
+                    [astuple(i) for i in getattr(b, attr)()]):
+                raise Exception(f"Different result for {path}")
+    print(f'|files|{len(files)}|')
+    for step in ("gml", "cold", "warm"):
+        print(f'|{step}|{timings[step]}|')
@@ -0,0 +1,227 @@
+# coding: utf-8
+"""Decomposition of a request into parts solved separately
+
+The connected components of a request, usually a central unit with its
+distributed units, only interact through the capacity of the physical
+network. Every component is solved as a request on its own, in a pool
+of processes if asked, and the solutions are combined by replaying
+their moves on one BranchAndBound of the whole request. If together
+they take more than the capacity of a host or an edge, the components
+that use it are coupled: they are joined in one group, solved jointly,
+and combined again until the solutions fit. Components without a
+central unit are joined with one that has it, and components without
+links with one that has them.
+
+The cost is not a sum over the groups: DoC counts the edges used by
+several groups once and divides by all the pools, and the UoC of every
+group adds up. So the best solution of every group is not always the
+best combination, and the combination is only an incumbent: it seeds a
+search of the whole request, which proves it optimal or improves it
+within the budget left, and the gap to the optimum is returned. A
+request that ends as a single group is not searched again. Without a
+budget the search of the whole request is exhaustive, so the groups only
+save time when there is one: they give a good incumbent early. The
+groups are searched with num_links of the whole network, so their UoC
+has the same scale as the combined one.
+"""
+import argparse
+import multiprocessing
+from collections import Counter, defaultdict
+from time import time
+
+from representation import *
+from reduction import components
+from search import Search
+from lns import solution_moves
+
+
+def request_components(requests):
+    """Lists of node ids of the connected parts of requests"""
+    component = components([node.id for node in requests.get_nodes()],
+                           requests.get_edges())
+    parts = defaultdict(list)
+    for node in requests.get_nodes():
+        parts[component[node.id]].append(node.id)
+    return list(parts.values())
+
+
+def initial_groups(requests):
+    """Lists of node ids of the components, the ones without central
+    units joined with the first one that has it, since the DoC of a
+    request without pools divides by zero, and then the ones without
+    links with the first one that has them, since their cost alone is 0
+    and the search of a group takes it for no embedding"""
+    parts = request_components(requests)
+    central = {node.id for node in requests.get_nodes()
+               if isinstance(node, CentralUnit)}
+    pools = [ids for ids in parts if central.intersection(ids)]
+    if not pools:
+        return [sum(parts, [])]
+    for ids in parts:
+        if not central.intersection(ids):
+            pools[0] += ids
+    ends = {link.source for link in requests.get_edges()}
+    linked = [ids for ids in pools if ends.intersection(ids)]
+    if not linked:
+        return [sum(pools, [])]
+    for ids in pools:
+        if not ends.intersection(ids):
+            linked[0] += ids
+    return linked
+
+
+def conflicts(p, results):
+    """Places the solutions of the groups on p, a BranchAndBound of the
+    whole request, and returns the sets of groups that share a host or
+    an edge whose capacity they exceed"""
+    residual = p.residual
+    users = defaultdict(set)  # ('node' or 'edge', position) -> groups
+    for number, (moves, cost, done, gap, stats) in enumerate(results):
+        for move in moves:
+            p.apply(move)
+            if move[0] == 'node':
+                users['node', residual.index[move[2]]].add(number)
+            else:
+                users['edge', residual.edge_index[move[3], move[4]]].add(number)
+    coupled = []
+    for (kind, pos), numbers in users.items():
+        if kind == 'node':
+            exceeded = min(residual.prc[pos], residual.prb[pos],
+                           residual.ant[pos]) < 0
+        else:
+            exceeded = residual.bandwith[pos] < 0
+        if exceeded and len(numbers) > 1:
+            coupled.append(numbers)
+    return coupled
+
+
+def subrequest(requests, ids):
+    """Topology of the nodes with id in ids and the links between them"""
+    ids = set(ids)
+    elements = defaultdict(list)
+    elements['nodes'] = [node for node in requests.get_nodes()
+                         if node.id in ids]
+    elements['edges'] = [link for link in requests.get_edges()
+                         if link.source in ids and link.target in ids]
+    return Topology(elements)
+
+
+def _solve(task):
+    physical, requests, num_links, max_nodes, max_time = task
+    stats = Counter()
+    p = BranchAndBound(physical, requests, num_links=num_links)
+    search = Search(p, stats=stats)
+    sol, cost = search.run(max_nodes=max_nodes, max_time=max_time)
+    moves = None if sol is None else solution_moves(sol)
+    return moves, cost, search.done, search.gap(), stats
+
+
+def solve(physical, requests, processes=1, max_nodes=None, max_time=None,
+          stats=None):
+    """Solves the groups of requests and searches the whole request from
+    their combined solution
+
+    Every search, of a group or of the whole request, gets at most
+    max_nodes states, and all of them max_time seconds in total. Returns
+    the best solution found, its cost, the proven gap to the optimum,
+    which is 0 when the search of the whole request was exhausted, and a
+    list with the size, cost and end of the search of every group. The
+    solution is None and the cost 0 if there is none.
+    """
+    if stats is None:
+        stats = Counter()
+    deadline = None if max_time is None else time() + max_time
+
+    def left():
+        return None if deadline is None else max(0, deadline - time())
+
+    num_links = len(physical.get_edges())
+    parts = initial_groups(requests)
+    solved = dict()  # Frozen set of node ids -> result of _solve
+    sol, cost = None, 0
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    try:
+        while True:
+            tasks = [ids for ids in parts if frozenset(ids) not in solved]
+            arguments = [(physical, subrequest(requests, ids), num_links,
+                          max_nodes, left()) for ids in tasks]
+            if pool is None or len(tasks) == 1:
+                results = list(map(_solve, arguments))
+            else:
+                results = pool.map(_solve, arguments)
+            for ids, result in zip(tasks, results):
+                solved[frozenset(ids)] = result
+                stats.update(result[4])
+            results = [solved[frozenset(ids)] for ids in parts]
+            report = [dict(nodes=len(ids), cost=cost, done=done)
+                      for ids, (moves, cost, done, gap, st)
+                      in zip(parts, results)]
+            if len(parts) == 1:
+                # The group is the whole request, searched already
+                moves, cost, done, gap, st = results[0]
+                if moves is None:
+                    return None, 0, gap, report
+                p = BranchAndBound(physical, requests)
+                for move in moves:
+                    p.apply(move)
+                return p.solution(), p.cost(), gap, report
+            if any(result[0] is None for result in results):
+                break
+            p = BranchAndBound(physical, requests)
+            coupled = conflicts(p, results)
+            if not coupled:
+                if not p.is_assigned():
+                    raise Exception("The solutions of the groups do not fit "
+                                    "together")
+                sol, cost = p.solution(), p.cost()
+                break
+            # Join every set of coupled groups and solve them again
+            joined = list(range(len(parts)))
+
+            def find(number):
+                while joined[number] != number:
+                    number = joined[number]
+                return number
+
+            for numbers in coupled:
+                first, *rest = numbers
+                for number in rest:
+                    joined[find(number)] = find(first)
+            merged = defaultdict(list)
+            for number, ids in enumerate(parts):
+                merged[find(number)] += ids
+            parts = list(merged.values())
+            stats["joined"] += len(results) - len(parts)
+    finally:
+        if pool is not None:
+            pool.close()
+    # The groups only give an incumbent, the search of the whole request
+    # proves it or finds a better one
+    search = Search(BranchAndBound(physical, requests), sol, cost, stats)
+    sol, cost = search.run(max_nodes=max_nodes, max_time=left())
+    return sol, cost, search.gap(), report
+
+
+if __name__ == '__main__':
+    from gml import load_physical, load_request
+
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("network")
+    args.add_argument("request")
+    args.add_argument("--processes", type=int, default=1)
+    args.add_argument("--max-nodes", type=int, default=None,
+                      help="states of every search")
+    args.add_argument("--max-time", type=float, default=None,
+                      help="seconds of search in total")
+    args = args.parse_args()
+    temp = time()
+    stats = Counter()
+    sol, cost, gap, report = solve(load_physical(args.network),
+                                   load_request(args.request),
+                                   args.processes, args.max_nodes,
+                                   args.max_time, stats)
+    print(f'|{args.request}|{args.network}|{cost}|{gap}|{time() - temp}|'
+          f'{len(report)}|{stats["expanded"]}|')
+    for number, group in enumerate(report):
+        print(f'|group {number}|{group["nodes"]}|{group["cost"]}|'
+              f'{group["done"]}|')
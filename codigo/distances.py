@@ -0,0 +1,148 @@
+# coding: utf-8
+"""Shortest delays and hops between every pair of physical nodes
+
+A DistanceMatrix holds, for every ordered pair of nodes of a physical
+network, the smallest sum of the delays of the edges of a path between
+them and the smallest number of hops, computed with one Dijkstra and
+one breadth first search per source. The delay of an edge is its
+`distance` in the networks of gml.py and its `delay` in the madrid
+networks of parser2.py. Unreachable pairs have infinite delay and hops.
+
+The matrices only depend on the nodes and edges of the network, so they
+are computed once per substrate and kept in the cache folder, in the
+format of cache.py and a file named by the SHA-256 of the node ids and
+the edges with their delays.
+
+BranchAndBound uses it, when given, to drop the hops after which a link
+cannot reach the host of its target within its delay and to try first
+the hops that get closer to it.
+"""
+import hashlib
+import heapq
+import os
+import struct
+from array import array
+from collections import defaultdict, deque
+
+import cache
+
+MAGIC = b"LFD2"
+INF = float("inf")
+
+
+def weight_of(edge):
+    """Delay of a physical edge of either format"""
+    return edge.delay if hasattr(edge, "delay") else edge.distance
+
+
+class DistanceMatrix:
+    """Shortest delays and hops between the nodes of a network
+
+    ids[i] is the id of the node in row i, index its inverse, and the
+    value for the rows i and j is at i * size + j of delays and hops.
+    """
+
+    def __init__(self, ids, delays, hops):
+        self.ids = list(ids)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.size = len(self.ids)
+        self.delays = delays
+        self.hops = hops
+
+    @classmethod
+    def from_topology(cls, physical):
+        ids = [node.id for node in physical.get_nodes()]
+        index = {id: i for i, id in enumerate(ids)}
+        size = len(ids)
+        neighbours = defaultdict(dict)
+        for edge in physical.get_edges():
+            source, target = index[edge.source], index[edge.target]
+            delay = weight_of(edge)
+            # Parallel edges, only the fastest one matters
+            if delay < neighbours[source].get(target, INF):
+                neighbours[source][target] = delay
+        delays = array('d', [INF]) * (size * size)
+        hops = array('d', [INF]) * (size * size)
+        for origin in range(size):
+            row = origin * size
+            delays[row + origin] = 0
+            queue = [(0, origin)]
+            while queue:
+                delay, pos = heapq.heappop(queue)
+                if delay > delays[row + pos]:
+                    continue
+                for other, weight in neighbours[pos].items():
+                    if delay + weight < delays[row + other]:
+                        delays[row + other] = delay + weight
+                        heapq.heappush(queue, (delay + weight, other))
+            hops[row + origin] = 0
+            queue = deque([origin])
+            while queue:
+                pos = queue.popleft()
+                for other in neighbours[pos]:
+                    if hops[row + other] == INF:
+                        hops[row + other] = hops[row + pos] + 1
+                        queue.append(other)
+        return cls(ids, delays, hops)
+
+    def delay(self, source, target):
+        """Shortest delay from the node id source to the node id target"""
+        return self.delays[self.index[source] * self.size + self.index[target]]
+
+    def hop(self, source, target):
+        """Fewest hops from the node id source to the node id target"""
+        return self.hops[self.index[source] * self.size + self.index[target]]
+
+    def dumps(self):
+        return cache.pack(MAGIC, {}, {"ids": array('q', self.ids),
+                                      "delays": self.delays,
+                                      "hops": self.hops})
+
+    @classmethod
+    def loads(cls, buffer):
+        columns = cache.unpack(buffer, MAGIC)[1]
+        return cls(columns["ids"], columns["delays"], columns["hops"])
+
+
+def key(physical):
+    """Name of the cached matrices of physical"""
+    digest = hashlib.sha256(MAGIC)
+    digest.update(array('q', [node.id for node in physical.get_nodes()])
+                  .tobytes())
+    for edge in physical.get_edges():
+        digest.update(struct.pack("<qqd", edge.source, edge.target,
+                                  weight_of(edge)))
+    return digest.hexdigest()
+
+
+def load(physical, cache_dir=cache.CACHE_DIR):
+    """DistanceMatrix of physical, from the cache if it was computed
+    before; cache_dir None computes it without the cache"""
+    if cache_dir is None:
+        return DistanceMatrix.from_topology(physical)
+    name = os.path.join(cache_dir, key(physical) + ".dist")
+    if os.path.exists(name):
+        with open(name, 'rb') as f:
+            return DistanceMatrix.loads(f.read())
+    matrix = DistanceMatrix.from_topology(physical)
+    cache.write(name, matrix.dumps())
+    return matrix
+
+
+if __name__ == '__main__':
+    # Computes (or loads) the matrices of the madrid networks
+    import sys
+    from time import perf_counter
+    from parser2 import FuncSplitLexer, PhysicalParser
+
+    DIR = "../instances"
+    names = sys.argv[1:] or ["madridTiny", "madridSmall", "madridMedium",
+                             "madridReal"]
+    for name in names:
+        with open(f"{DIR}/madrid/{name}.gml") as f:
+            physical = PhysicalParser().parse(FuncSplitLexer().tokenize(f.read()))
+        temp = perf_counter()
+        matrix = load(physical)
+        finite = [hops for hops in matrix.hops if hops != INF]
+        print(f'|{name}|{matrix.size}|{perf_counter() - temp}|'
+              f'{max(finite, default=0)}|{len(finite)}|')
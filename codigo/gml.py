@@ -0,0 +1,169 @@
+# coding: utf-8
+"""Fast loader for the GML instances
+
+It builds the same Topology objects as PhysicalParser and RequestParser
+in parser.py, with the same shift semantics and the same default shift
+of 1, but scans the text with two regular expressions instead of going
+through sly, so no parsing tables are built and no debug files are
+written.
+"""
+import os
+import re
+from collections import defaultdict
+
+from representation import *
+
+_BLOCK = re.compile(r'([A-Za-z]+)\s*\[([^\[\]]*)\]')
+_ATTR = re.compile(r'([A-Za-z]+)\s+(?:"(\w+)"|([0-9]+(?:\.[0-9]+)*))\s*')
+_GRAPH = re.compile(r'\s*graph\s*\[', re.IGNORECASE)
+
+KEYWORDS = {"id", "label", "x", "y", "prc", "ant", "prb", "theta",
+            "source", "target", "distance", "bandwith", "type", "delay"}
+SPECIAL = {'x', 'y', 'prb', 'prc', 'ant', 'theta',
+           'bandwith', 'distance', 'type', 'delay'}
+
+
+def scan(text, shift, label):
+    """Yields ('node' or 'edge', attributes) for every block of the graph
+
+    Numbers of the attributes that are not in SPECIAL are shifted and
+    every string is stored as the label, formatted by label(string).
+    Missing attributes are 0, as in the parsers.
+    """
+    graph = _GRAPH.match(text)
+    if graph is None:
+        raise Exception("Expected graph [")
+    end = text.rindex(']')
+    for block in _BLOCK.finditer(text, graph.end(), end):
+        kind = block.group(1).lower()
+        if kind not in ("node", "edge"):
+            raise Exception(f'Unexpected {block.group(1)} at {block.start()}')
+        body = block.group(2)
+        attrs = defaultdict(int)
+        pos = len(body) - len(body.lstrip())
+        for attr in _ATTR.finditer(body, pos):
+            if attr.start() != pos:
+                break
+            pos = attr.end()
+            key, string, number = attr.groups()
+            key = key.lower()
+            if key not in KEYWORDS:
+                raise Exception(f'Unknown keyword {key} in {kind} at {block.start()}')
+            if string is not None:
+                attrs["label"] = label(string)
+            else:
+                value = float(number) if '.' in number else int(number)
+                attrs[key] = value if key in SPECIAL else value + shift
+        if pos != len(body):
+            raise Exception(f'Syntax error in {kind} at {block.start()}')
+        yield kind, attrs
+
+
+def parse_request(text, shift=1):
+    elements = defaultdict(list)
+    for kind, attrs in scan(text, shift, lambda string: string + str(shift)):
+        if kind == "edge":
+            elements['edges'].append(EdgeVirtual(attrs["source"],
+                                                 attrs["target"],
+                                                 attrs["bandwith"],
+                                                 attrs["delay"]))
+        elif attrs["type"] == 1:
+            elements['nodes'].append(DistributedUnit(attrs["id"],
+                                                     attrs["label"],
+                                                     attrs["x"],
+                                                     attrs["y"],
+                                                     attrs["prc"],
+                                                     attrs["prb"],
+                                                     attrs["ant"],
+                                                     attrs["theta"]))
+        else:
+            elements['nodes'].append(CentralUnit(attrs["id"],
+                                                 attrs["label"],
+                                                 attrs["x"],
+                                                 attrs["y"],
+                                                 0 if attrs["type"] == 3
+                                                 else attrs["prc"]))
+    return Topology(elements)
+
+
+def parse_physical(text, shift=1):
+    elements = defaultdict(list)
+    for kind, attrs in scan(text, shift, lambda string: f'{shift}_{string}'):
+        if kind == "edge":
+            elements['edges'].append(EdgePhysical(attrs["source"],
+                                                  attrs["target"],
+                                                  attrs["bandwith"],
+                                                  attrs["distance"],
+                                                  attrs["type"]))
+            elements['edges'].append(EdgePhysical(attrs["target"],
+                                                  attrs["source"],
+                                                  attrs["bandwith"],
+                                                  attrs["distance"],
+                                                  attrs["type"]))
+        elif attrs["type"] == 1:
+            elements['nodes'].append(DistributedUnit(attrs["id"],
+                                                     attrs["label"],
+                                                     attrs["x"],
+                                                     attrs["y"],
+                                                     attrs["prc"],
+                                                     attrs["prb"],
+                                                     attrs["ant"],
+                                                     attrs["theta"]))
+        else:
+            elements['nodes'].append(CentralUnit(attrs["id"],
+                                                 attrs["label"],
+                                                 attrs["x"],
+                                                 attrs["y"],
+                                                 attrs["prc"]))
+    return Topology(elements)
+
+
+def load_request(path, shift=1):
+    with open(path, 'r') as f:
+        return parse_request(f.read(), shift)
+
+
+def load_physical(path, shift=1):
+    with open(path, 'r') as f:
+        return parse_physical(f.read(), shift)
+
+
+def sample_files(directory, sample):
+    """(kind, path) of about sample networks and sample requests, evenly
+    spaced in the sorted lists of the GML files under directory"""
+    files = []
+    for kind in ("networks", "requests"):
+        paths = sorted(os.path.join(root, name)
+                       for root, dirs, names in os.walk(f"{directory}/{kind}")
+                       for name in names if name.endswith(".gml"))
+        files += [(kind, path) for path in paths[::max(1, len(paths) // sample)]]
+    return files
+
+
+if __name__ == '__main__':
+    # Compares this loader with the sly parsers on a sample of instances
+    import sys
+    from dataclasses import astuple
+    from time import perf_counter
+    from parser import load, PhysicalParser, RequestParser
+
+    DIR = "../instances"
+    files = sample_files(DIR, int(sys.argv[1]) if len(sys.argv) > 1 else 50)
+    timings = defaultdict(float)
+    for kind, path in files:
+        fast = load_physical if kind == "networks" else load_request
+        slow = PhysicalParser if kind == "networks" else RequestParser
+        temp = perf_counter()
+        a = load(path, slow, 10)
+        timings["sly"] += perf_counter() - temp
+        temp = perf_counter()
+        b = fast(path, 10)
+        timings["gml"] += perf_counter() - temp
+        for attr in ("get_nodes", "get_edges"):
+            if ([astuple(i) for i in getattr(a, attr)()] !=
+                    [astuple(i) for i in getattr(b, attr)()]):
+                raise Exception(f"Different result for {path}")
+    print(f'|files|{len(files)}|')
+    print(f'|sly|{timings["sly"]}|')
+    print(f'|gml|{timings["gml"]}|')
+    print(f'|speedup|{timings["sly"] / timings["gml"]}|')
@@ -0,0 +1,203 @@
+# coding: utf-8
+"""Greedy construction of an embedding
+
+It places the central units on the hosts with most residual prc, then
+every distributed unit on the host closest to the hosts of its neighbours
+that still fits it, and routes the links one after the other along the
+widest, the shortest or a long path with enough residual bandwith. Long
+paths over edges not used yet raise DoC, which the cost rewards.
+
+It is a fast solver on its own and its cost is a good first incumbent for
+the exact search, which otherwise cannot prune until it reaches its first
+leaf.
+"""
+import heapq
+from collections import deque
+
+from representation import *
+
+ROUTES = ("widest", "shortest", "longest")
+
+
+def route(p, source, target, bandwith, how="widest"):
+    """Positions of the edges of a path from the host source to target in
+    which every edge has at least bandwith left, or None
+
+    widest maximises the smallest residual bandwith of the path and
+    shortest minimises the number of hops. longest walks from source and
+    takes at every step the edge not used by other paths, if any, to the
+    node farthest from target that can still reach it.
+    """
+    residual = p.residual
+    origin, goal = residual.index[source], residual.index[target]
+    previous = {origin: None}  # Node position -> edge position to reach it
+    if how == "longest":
+        pos, path, visited = origin, [], {origin}
+        if goal not in hops_to(p, origin, goal, bandwith, ()):
+            return None
+        while pos != goal:
+            best = None
+            for edge in residual.out_edges(pos):
+                node = residual.target[edge]
+                if node in visited or residual.bandwith[edge] < bandwith:
+                    continue
+                hops = hops_to(p, node, goal, bandwith, visited).get(goal)
+                if hops is None:
+                    continue
+                key = (not p.edge_use.get(edge), hops, -node)
+                if best is None or key > best[0]:
+                    best = (key, edge, node)
+            # The goal is reachable from pos avoiding visited, so best exists
+            path.append(best[1])
+            pos = best[2]
+            visited.add(pos)
+        return path
+    if how == "shortest":
+        queue = deque([origin])
+        while queue and goal not in previous:
+            pos = queue.popleft()
+            for edge in residual.out_edges(pos):
+                node = residual.target[edge]
+                if node not in previous and residual.bandwith[edge] >= bandwith:
+                    previous[node] = edge
+                    queue.append(node)
+    else:
+        width = {origin: float("inf")}
+        queue = [(-width[origin], origin)]
+        done = set()
+        while queue:
+            _, pos = heapq.heappop(queue)
+            if pos in done:
+                continue
+            done.add(pos)
+            if pos == goal:
+                break
+            for edge in residual.out_edges(pos):
+                node = residual.target[edge]
+                temp = min(width[pos], residual.bandwith[edge])
+                if (node not in done and temp >= bandwith
+                        and temp > width.get(node, float("-inf"))):
+                    width[node] = temp
+                    previous[node] = edge
+                    heapq.heappush(queue, (-temp, node))
+    if goal not in previous:
+        return None
+    path = []
+    pos = goal
+    while previous[pos] is not None:
+        path.append(previous[pos])
+        pos = residual.source[previous[pos]]
+    return path[::-1]
+
+
+def hops_to(p, origin, goal, bandwith, avoid):
+    """Hops from the node in position origin to the nodes found before
+    goal, without going through the positions in avoid"""
+    residual = p.residual
+    hops = {origin: 0}
+    queue = deque([origin])
+    while queue and goal not in hops:
+        pos = queue.popleft()
+        for edge in residual.out_edges(pos):
+            node = residual.target[edge]
+            if (node not in hops and node not in avoid
+                    and residual.bandwith[edge] >= bandwith):
+                hops[node] = hops[pos] + 1
+                queue.append(node)
+    return hops
+
+
+def hops_from(p, source, bandwith):
+    """Number of hops from the host source to every reachable host using
+    edges with at least bandwith left"""
+    residual = p.residual
+    origin = residual.index[source]
+    hops = {origin: 0}
+    queue = deque([origin])
+    while queue:
+        pos = queue.popleft()
+        for edge in residual.out_edges(pos):
+            node = residual.target[edge]
+            if node not in hops and residual.bandwith[edge] >= bandwith:
+                hops[node] = hops[pos] + 1
+                queue.append(node)
+    return hops
+
+
+def place(p):
+    """Moves that place every request node, or None if one does not fit"""
+    residual = p.residual
+    nodes = sorted(p.requests.get_nodes(),
+                   key=lambda node: (isinstance(node, DistributedUnit),
+                                     -node.prc, node.id))
+    links = defaultdict(list)
+    for link in p.requests.get_edges():
+        links[link.source].append((link.target, link.bandwith))
+        links[link.target].append((link.source, link.bandwith))
+    moves = []
+    for node in nodes:
+        distance = defaultdict(int)
+        for neighbour, bandwith in links[node.id]:
+            if neighbour in p.hosts:
+                hops = hops_from(p, p.hosts[neighbour], bandwith)
+                for pos in range(len(residual.nodes)):
+                    distance[pos] += hops.get(pos, len(residual.nodes))
+        candidates = [residual.index[host] for host in p.domains[node.id]
+                      if host not in p.removed[node.id]]
+        candidates = [pos for pos in candidates if residual.fits(node, pos)]
+        if not candidates:
+            return None
+        pos = min(candidates, key=lambda pos: (distance[pos], -residual.prc[pos]))
+        move = ('node', node.id, residual.nodes[pos].id)
+        p.apply(move)
+        moves.append(move)
+    return moves
+
+
+def greedy(p, how="widest"):
+    """Builds one embedding on p with route(how) and leaves p as it was
+
+    Returns the solution and its cost, or None and 0 if it fails.
+    """
+    mark = p.mark()
+    try:
+        if place(p) is None or not p.feasible():
+            return None, 0
+        residual = p.residual
+        for link in p.requests.get_edges():
+            path = route(p, p.hosts[link.source], p.hosts[link.target],
+                         link.bandwith, how)
+            if path is None:
+                return None, 0
+            for edge in path:
+                p.apply(('link', link.source, link.target,
+                         residual.nodes[residual.source[edge]].id,
+                         residual.nodes[residual.target[edge]].id))
+            if p.distances is not None and p.path_delay(link) > link.delay:
+                return None, 0
+        if not p.is_assigned():
+            return None, 0
+        return p.solution(), p.cost()
+    finally:
+        p.undo(mark)
+
+
+def warm_start(p):
+    """Best solution of greedy() over all the ROUTES, to seed the search"""
+    sol, best_cost = None, 0
+    for how in ROUTES:
+        sol1, ct = greedy(p, how)
+        if sol1 is not None and ct > best_cost:
+            sol, best_cost = sol1, ct
+    return sol, best_cost
+
+
+if __name__ == '__main__':
+    import sys
+    from time import time
+    from gml import load_physical, load_request
+
+    temp = time()
+    p = BranchAndBound(load_physical(sys.argv[1]), load_request(sys.argv[2]))
+    sol, cost = warm_start(p)
+    print(f'|{sys.argv[2]}|{sys.argv[1]}|{cost}|{time() - temp}|')
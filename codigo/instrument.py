@@ -0,0 +1,111 @@
+# coding: utf-8
+"""Counters and timers of a search
+
+A Profiler is attached to one BranchAndBound and replaces its apply,
+undo, moves, cost and bound methods by timed versions on that instance
+only, so a search that is not profiled runs the same code as before.
+It counts the states expanded at every depth, the time spent placing
+nodes, routing links, generating moves, computing the cost and
+computing the bound, each in its own timer (the cost of the leaves that
+bound() computes is also in the cost timer), and the largest depth and
+frontier. report() joins them with the
+counters of the driver, and with an output file the report is written
+as a JSON line every `every` seconds and at close().
+"""
+import json
+from collections import Counter, defaultdict
+from time import perf_counter, time
+
+# Timer of every kind of move
+TIMERS = {'node': "node", 'link': "link", 'path': "link"}
+
+
+class Profiler:
+
+    def __init__(self, stats=None, output=None, every=None):
+        self.stats = Counter() if stats is None else stats
+        self.output = output
+        self.every = every
+        self.depths = Counter()  # Depth -> states expanded
+        self.times = defaultdict(float)
+        self.marks = []  # Trail length before every move applied
+        self.max_depth = 0
+        self.max_frontier = 0
+        self.inside = False
+        self.start = self.last = time()
+
+    def attach(self, p):
+        apply, undo, moves = p.apply, p.undo, p.moves
+        cost, bound = p.cost, p.bound
+
+        def timed_apply(move):
+            if self.inside:
+                # The hops of a path move
+                return apply(move)
+            self.marks.append(p.mark())
+            self.max_depth = max(self.max_depth, len(self.marks))
+            self.inside = True
+            temp = perf_counter()
+            try:
+                return apply(move)
+            finally:
+                self.times[TIMERS.get(move[0], move[0])] += perf_counter() - temp
+                self.inside = False
+
+        def timed_undo(mark):
+            temp = perf_counter()
+            undo(mark)
+            self.times["undo"] += perf_counter() - temp
+            while self.marks and self.marks[-1] >= mark:
+                self.marks.pop()
+
+        def timed_moves():
+            temp = perf_counter()
+            result = moves()
+            self.times["moves"] += perf_counter() - temp
+            self.depths[len(self.marks)] += 1
+            if self.every is not None and time() - self.last >= self.every:
+                self.write()
+            return result
+
+        def timed(method, name):
+            def wrapper():
+                temp = perf_counter()
+                result = method()
+                self.times[name] += perf_counter() - temp
+                return result
+            return wrapper
+
+        p.apply, p.undo, p.moves = timed_apply, timed_undo, timed_moves
+        p.cost, p.bound = timed(cost, "cost"), timed(bound, "bound")
+        return p
+
+    def detach(self, p):
+        for name in ("apply", "undo", "moves", "cost", "bound"):
+            p.__dict__.pop(name, None)
+        return p
+
+    def frontier(self, size):
+        """Called by the drivers with the number of open states"""
+        self.max_frontier = max(self.max_frontier, size)
+
+    def report(self):
+        return {"elapsed": time() - self.start,
+                "stats": dict(self.stats),
+                "expanded_by_depth": dict(sorted(self.depths.items())),
+                "times": dict(self.times),
+                "max_depth": self.max_depth,
+                "max_frontier": self.max_frontier}
+
+    def write(self):
+        self.last = time()
+        if self.output is not None:
+            with open(self.output, "a") as f:
+                f.write(json.dumps(self.report()) + "\n")
+
+    def close(self, p=None):
+        """Writes the last report and detaches from p, if given"""
+        self.write()
+        if p is not None:
+            self.detach(p)
+        return self.report()
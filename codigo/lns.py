@@ -0,0 +1,173 @@
+# coding: utf-8
+"""Large neighbourhood search for the instances the exact search cannot
+finish
+
+LNS starts from a feasible embedding, the greedy one of heuristic.py by
+default, and repeats: free a neighbourhood of the incumbent, place again
+the rest of it on the BranchAndBound, and search the freed part depth
+first for at most `budget` states with the incumbent cost as the bar, so
+only better embeddings are found. A neighbourhood is either a pool, a
+request central unit with the distributed units linked to it and all
+their links, or `size` random links. Nodes not freed keep their hosts and
+links not freed keep their paths.
+
+The random choices come from a generator seeded with `seed`, so a run
+with the same budgets of states is repeated exactly. Every improvement
+is kept in curve as (seconds, iteration, cost) and, with an output file,
+appended to it as a JSON line.
+"""
+import argparse
+import json
+import random
+from collections import Counter, defaultdict
+from time import time
+
+from representation import *
+from heuristic import warm_start
+from search import Search
+
+NEIGHBOURHOODS = ("pool", "links")
+
+
+def solution_moves(solution):
+    """Moves that place the nodes and route the links of solution"""
+    moves = [('node', node.id, host.id)
+             for node, host in solution.node_correspondance.items()]
+    for link, path in solution.edge_correspondance.items():
+        moves += [('link', link.source, link.target, edge.source, edge.target)
+                  for edge in path]
+    return moves
+
+
+class LNS:
+    """Large neighbourhood search on p, a BranchAndBound at its root
+
+    sol and cost are the embedding to start from, if any.
+    """
+
+    def __init__(self, p, sol=None, cost=0, seed=0, budget=1000, size=3,
+                 neighbourhoods=NEIGHBOURHOODS, stats=None, output=None):
+        self.p = p
+        self.sol, self.cost = sol, cost
+        self.random = random.Random(seed)
+        self.budget = budget
+        self.size = size
+        self.neighbourhoods = neighbourhoods
+        self.stats = Counter() if stats is None else stats
+        self.output = output
+        self.curve = []
+        self.iteration = 0
+        self.start = time()
+        self.neighbours = defaultdict(set)  # Request node id -> linked ids
+        for link in p.requests.get_edges():
+            self.neighbours[link.source].add(link.target)
+            self.neighbours[link.target].add(link.source)
+
+    def initial(self, max_time=None):
+        """Greedy embedding, or the first leaf of the depth first search"""
+        if self.sol is None:
+            self.sol, self.cost = warm_start(self.p)
+        if self.sol is None:
+            search = Search(self.p, stats=self.stats)
+            while self.sol is None and not search.done:
+                left = None if max_time is None else max_time - (time() - self.start)
+                if left is not None and left <= 0:
+                    break
+                self.sol, self.cost = search.run(max_nodes=self.budget,
+                                                 max_time=left)
+            search.goto(())
+        if self.sol is not None:
+            self.log()
+        return self.sol, self.cost
+
+    def neighbourhood(self, kind):
+        """Ids of the request nodes and links freed by a neighbourhood"""
+        p = self.p
+        links = p.requests.get_edges()
+        pools = [node.id for node in p.requests.get_nodes()
+                 if isinstance(node, CentralUnit)]
+        if kind == "pool" and pools:
+            pool = self.random.choice(pools)
+            nodes = {pool} | {id for id in self.neighbours[pool]
+                              if isinstance(p.requests.get_node_by_id(id),
+                                            DistributedUnit)}
+            freed = {(link.source, link.target) for link in links
+                     if link.source in nodes or link.target in nodes}
+            return nodes, freed
+        freed = self.random.sample(links, min(self.size, len(links)))
+        return set(), {(link.source, link.target) for link in freed}
+
+    def step(self, max_time=None):
+        """Frees one neighbourhood and searches it, returns True if the
+        incumbent improves"""
+        p = self.p
+        self.iteration += 1
+        kind = self.random.choice(self.neighbourhoods)
+        nodes, links = self.neighbourhood(kind)
+        self.stats[kind] += 1
+        mark = p.mark()
+        try:
+            for move in solution_moves(self.sol):
+                if move[0] == 'node' and move[1] in nodes:
+                    continue
+                if move[0] == 'link' and move[1:3] in links:
+                    continue
+                p.apply(move)
+            search = Search(p, self.sol, self.cost, self.stats)
+            sol, cost = search.run(max_nodes=self.budget, max_time=max_time)
+            search.goto(())
+        finally:
+            p.undo(mark)
+        if cost > self.cost:
+            self.sol, self.cost = sol, cost
+            self.stats["improvements"] += 1
+            self.log()
+            return True
+        return False
+
+    def run(self, max_time=None, max_iterations=None):
+        """Improves the incumbent until a limit of seconds or iterations,
+        returns the best solution and its cost"""
+        self.initial(max_time)
+        if self.sol is None:
+            return None, 0
+        while max_iterations is None or self.iteration < max_iterations:
+            left = None if max_time is None else max_time - (time() - self.start)
+            if left is not None and left <= 0:
+                break
+            self.step(left)
+        return self.sol, self.cost
+
+    def log(self):
+        point = (time() - self.start, self.iteration, self.cost)
+        self.curve.append(point)
+        if self.output is not None:
+            with open(self.output, "a") as f:
+                f.write(json.dumps(dict(zip(("time", "iteration", "cost"),
+                                            point))) + "\n")
+
+
+if __name__ == '__main__':
+    from gml import load_physical, load_request
+
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("network")
+    args.add_argument("request")
+    args.add_argument("--max-time", type=float, default=60)
+    args.add_argument("--max-iterations", type=int, default=None)
+    args.add_argument("--budget", type=int, default=1000,
+                      help="states searched in every neighbourhood")
+    args.add_argument("--size", type=int, default=3,
+                      help="links freed by a links neighbourhood")
+    args.add_argument("--seed", type=int, default=0)
+    args.add_argument("--output", default=None,
+                      help="file to append the improvements to, as JSON "
+                           "lines")
+    args = args.parse_args()
+    p = BranchAndBound(load_physical(args.network), load_request(args.request))
+    lns = LNS(p, seed=args.seed, budget=args.budget, size=args.size,
+              output=args.output)
+    sol, cost = lns.run(args.max_time, args.max_iterations)
+    print(f'|{args.request}|{args.network}|{cost}|{time() - lns.start}|'
+          f'{lns.iteration}|{lns.stats["improvements"]}|'
+          f'{lns.stats["expanded"]}|')
@@ -0,0 +1,114 @@
+# coding: utf-8
+"""Embedding of a sequence of requests in one physical network
+
+The requests of a folder are meant to share the same substrate, so the
+network is loaded and indexed once and every request is searched on the
+capacity left by the ones accepted before. A request is accepted when
+the search finds an embedding within its budget, and then the embedding
+is committed: its demands are taken from the shared ResidualNetwork for
+good. The cost of every request is the one of its own embedding.
+"""
+import argparse
+import json
+import os
+import statistics
+from collections import Counter
+from time import perf_counter
+
+from representation import *
+from heuristic import warm_start
+from search import Search
+
+
+def commit(residual, solution, sign=1):
+    """Takes (or gives back, with sign -1) the capacity used by solution
+    from the residual network"""
+    for node, host in solution.node_correspondance.items():
+        residual.place(node, residual.index[host.id], sign)
+    for link, path in solution.edge_correspondance.items():
+        for edge in path:
+            residual.bandwith[residual.edge_index[edge.source, edge.target]] \
+                -= sign * link.bandwith
+
+
+class Online:
+    """Embeds requests one after another in physical
+
+    Every request gets a depth first search of at most max_nodes states
+    or max_time seconds, seeded with the greedy heuristic if warm.
+    """
+
+    def __init__(self, physical, order="id", max_nodes=None, max_time=None,
+                 warm=False):
+        self.physical = physical
+        # Floats, so any demand can be taken from it
+        self.residual = ResidualNetwork.from_topology(physical, 'd')
+        self.classes = host_classes(physical)
+        self.order = order
+        self.max_nodes, self.max_time = max_nodes, max_time
+        self.warm = warm
+        self.accepted = []  # Solutions committed, in order
+        self.results = []
+
+    def embed(self, requests, name=None):
+        """Searches an embedding of requests and commits it if found"""
+        temp = perf_counter()
+        stats = Counter()
+        p = BranchAndBound(self.physical, requests, self.order,
+                           residual=self.residual, classes=self.classes)
+        sol, cost = warm_start(p) if self.warm else (None, 0)
+        search = Search(p, sol, cost, stats)
+        sol, cost = search.run(max_nodes=self.max_nodes,
+                               max_time=self.max_time)
+        # Leave the residual network as the search found it
+        search.goto(())
+        if sol is not None:
+            commit(self.residual, sol)
+            self.accepted.append(sol)
+        result = dict(request=name, accepted=sol is not None,
+                      cost=cost if sol is not None else None,
+                      exhausted=search.done, latency=perf_counter() - temp,
+                      expanded=stats["expanded"])
+        self.results.append(result)
+        return result
+
+    def report(self):
+        latencies = [result["latency"] for result in self.results]
+        accepted = sum(result["accepted"] for result in self.results)
+        return {"requests": len(self.results),
+                "accepted": accepted,
+                "acceptance_ratio": (accepted / len(self.results)
+                                     if self.results else None),
+                "latency_mean": statistics.mean(latencies) if latencies else None,
+                "latency_max": max(latencies, default=None),
+                "total_cost": sum(result["cost"] for result in self.results
+                                  if result["accepted"])}
+
+
+if __name__ == '__main__':
+    from gml import load_physical, load_request
+    from batch import gml_files
+
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("network")
+    args.add_argument("requests", help="folder with the request files")
+    args.add_argument("--max-nodes", type=int, default=None,
+                      help="states searched per request")
+    args.add_argument("--max-time", type=float, default=None,
+                      help="seconds of search per request")
+    args.add_argument("--warm-start", action="store_true")
+    args.add_argument("--output", default=None,
+                      help="JSON lines file with every request")
+    args = args.parse_args()
+    temp = perf_counter()
+    online = Online(load_physical(args.network), max_nodes=args.max_nodes,
+                    max_time=args.max_time, warm=args.warm_start)
+    print(f'|setup|{perf_counter() - temp}|')
+    for path in sorted(gml_files(args.requests)):
+        result = online.embed(load_request(path), os.path.relpath(path))
+        print(f'|{result["request"]}|{result["accepted"]}|{result["cost"]}|'
+              f'{result["latency"]}|{result["expanded"]}|')
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(result) + "\n")
+    print(f'|report|{json.dumps(online.report())}|')
@@ -217,6 +217,15 @@ class PhysicalParser(sly.Parser):
         return p.attrs
 
 
+def load(path, parser_class, shift=1):
+    """Parses the GML file in path with a PhysicalParser or RequestParser"""
+    with open(path, 'r') as f:
+        in_ = f.read()
+    lexer, parser = FuncSplitLexer(), parser_class()
+    parser.shift = shift
+    return parser.parse(lexer.tokenize(in_))
+
+
 if __name__ == '__main__':
     DIR = "../instances"
     f = open(f"{DIR}/networks/small/DU2CU1/Gn3e2.gml", 'r')
@@ -167,12 +167,12 @@ class PhysicalParser(sly.Parser):
         return (EdgePhysical(p.attrs["source"],
                             p.attrs["target"],
                             p.attrs["bandwidth"],
-                            p.attrs["distance"],
+                            p.attrs["delay"],
                              p.attrs["type"]),
                 EdgePhysical(p.attrs["target"],
                             p.attrs["source"],
                             p.attrs["bandwidth"],
-                            p.attrs["distance"],
+                            p.attrs["delay"],
                             p.attrs["type"]))
 
     @_('')
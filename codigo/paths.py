@@ -0,0 +1,103 @@
+# coding: utf-8
+"""Catalogue of the physical paths between pairs of hosts
+
+With a PathCatalogue, BranchAndBound maps every virtual link in a single
+step, with one ('path', request source, request target, hosts) move per
+path of the catalogue between the hosts of its ends that still has
+enough residual bandwith, instead of growing the path one hop per level
+of the tree.
+
+The paths of a pair of hosts are found the first time they are asked for
+and kept, so a catalogue built on a physical network can be shared by
+all the requests solved on it. By default it keeps the K paths with
+fewest hops of every pair, which makes the search a heuristic whose gaps
+and optima are only over the paths kept, like max_hops or max_distance.
+With k=None and no other limit it holds every simple path and the search
+is exact, but there are exponentially many of them, so it is only
+usable on the small networks.
+"""
+from collections import deque
+
+from representation import *
+
+K = 8  # Paths kept per pair of hosts by default
+
+
+class PathCatalogue:
+    """Simple paths of a physical network indexed by their ends
+
+    k is the largest number of paths kept per pair, None for all, and
+    max_hops and max_distance the longest path in hops and in the sum of
+    the distance of its edges. Edges with less than bandwith are never
+    used. The paths are found in breadth first order, so the k paths
+    kept are the ones with fewest hops. With the DistanceMatrix distances
+    of physical, the partial paths that cannot reach their end within
+    max_hops or max_distance are not extended.
+    """
+
+    def __init__(self, physical, k=K, max_hops=None, max_distance=None,
+                 bandwith=0, distances=None):
+        self.network = ResidualNetwork.from_topology(physical)
+        self.distances = distances
+        self.k = k
+        self.max_hops = max_hops
+        self.max_distance = max_distance
+        self.bandwith = bandwith
+        self.paths = dict()  # (source id, target id) -> [(hosts, edges)]
+
+    def get(self, source, target):
+        """Paths from the host source to target as (host ids, edge
+        positions) pairs of tuples"""
+        key = (source, target)
+        if key not in self.paths:
+            self.paths[key] = self.search(source, target)
+        return self.paths[key]
+
+    def search(self, source, target):
+        network = self.network
+        origin, goal = network.index[source], network.index[target]
+        result = []
+        if origin == goal:
+            return result
+        distance = [edge.distance for edge in network.edges]
+        # Shortest delay and hops from every node position to goal
+        if self.distances is None:
+            delays = hops = [0] * len(network.nodes)
+        else:
+            delays = [self.distances.delay(node.id, target)
+                      for node in network.nodes]
+            hops = [self.distances.hop(node.id, target)
+                    for node in network.nodes]
+        # Partial paths as (node positions, edge positions, distance)
+        queue = deque([((origin,), (), 0)])
+        while queue and (self.k is None or len(result) < self.k):
+            nodes, edges, length = queue.popleft()
+            if self.max_hops is not None and len(edges) >= self.max_hops:
+                continue
+            for pos in network.out_edges(nodes[-1]):
+                node = network.target[pos]
+                if node in nodes or network.capacity[pos] < self.bandwith:
+                    continue
+                total = length + distance[pos]
+                if (self.max_distance is not None
+                        and total + delays[node] > self.max_distance):
+                    continue
+                if (self.max_hops is not None
+                        and len(edges) + 1 + hops[node] > self.max_hops):
+                    continue
+                if node == goal:
+                    result.append((tuple(network.nodes[i].id
+                                         for i in nodes + (node,)),
+                                   edges + (pos,)))
+                    if self.k is not None and len(result) >= self.k:
+                        break
+                else:
+                    queue.append((nodes + (node,), edges + (pos,), total))
+        return result
+
+    def longest(self):
+        """Upper bound on the hops of any path of the catalogue"""
+        hops = len(self.network.nodes) - 1
+        if self.max_hops is not None:
+            hops = min(hops, self.max_hops)
+        return hops
@@ -0,0 +1,128 @@
+# coding: utf-8
+"""Removal of the parts of a physical network a request cannot use
+
+Before the search, reduce() drops from the physical network
+
+- the edges with less bandwith than every link of the request,
+- the nodes that cannot host any request node and have less than two
+  neighbours left, again until there are none, since a path can only go
+  through a node from one neighbour to another,
+- the connected components without a central unit that fits a request
+  central unit, when every connected part of the request has one,
+
+and renumbers the nodes left from 0. Nodes that cannot host anything but
+join two others are kept, paths through them add to DoC. Every edge
+that can be used keeps its capacity, so passing num_links, the number of
+edges of the whole network, to BranchAndBound gives the same costs and
+the same optimum as the search on the whole network.
+"""
+from collections import defaultdict
+from dataclasses import replace
+
+from representation import *
+
+
+class Reduction:
+    """Reduced network with the mapping back to the original one
+
+    ids[i] is the original id of the node i of physical.
+    """
+
+    def __init__(self, original, physical, ids):
+        self.original = original
+        self.physical = physical
+        self.ids = ids
+        self.num_links = len(original.get_edges())
+
+    def restore(self, solution):
+        """Solution on physical with the original nodes and edges"""
+        if solution is None:
+            return None
+        original = self.original
+        nodes = {node: original.get_node_by_id(self.ids[host.id])
+                 for node, host in solution.node_correspondance.items()}
+        edges = {link: [original.get_edge(self.ids[edge.source],
+                                          self.ids[edge.target])
+                         for edge in path]
+                 for link, path in solution.edge_correspondance.items()}
+        return Solution(nodes, edges, solution.cost)
+
+    def stats(self):
+        return {"nodes": len(self.original.get_nodes()),
+                "edges": len(self.original.get_edges()),
+                "reduced_nodes": len(self.physical.get_nodes()),
+                "reduced_edges": len(self.physical.get_edges())}
+
+
+def components(nodes, edges):
+    """Node id -> number of its connected component"""
+    neighbours = defaultdict(list)
+    for edge in edges:
+        neighbours[edge.source].append(edge.target)
+        neighbours[edge.target].append(edge.source)
+    component = dict()
+    for node in nodes:
+        if node in component:
+            continue
+        component[node] = node
+        stack = [node]
+        while stack:
+            for other in neighbours[stack.pop()]:
+                if other not in component:
+                    component[other] = node
+                    stack.append(other)
+    return component
+
+
+def reduce(physical, requests):
+    """Reduction of physical for requests"""
+    request_nodes = requests.get_nodes()
+    links = requests.get_edges()
+    hosts = {node.id for node in physical.get_nodes()
+             if any(fits(request, node) for request in request_nodes)}
+    narrowest = min((link.bandwith for link in links), default=0)
+    edges = [edge for edge in physical.get_edges()
+             if edge.bandwith >= narrowest]
+    nodes = {node.id for node in physical.get_nodes()}
+    # Nodes that cannot be in a path, only at its end
+    neighbours = defaultdict(set)
+    for edge in edges:
+        neighbours[edge.source].add(edge.target)
+        neighbours[edge.target].add(edge.source)
+    stack = [id for id in nodes if id not in hosts and len(neighbours[id]) < 2]
+    while stack:
+        id = stack.pop()
+        if id not in nodes:
+            continue
+        nodes.discard(id)
+        for other in neighbours.pop(id, ()):
+            neighbours[other].discard(id)
+            if (other in nodes and other not in hosts
+                    and len(neighbours[other]) < 2):
+                stack.append(other)
+    edges = [edge for edge in edges
+             if edge.source in nodes and edge.target in nodes]
+    # Every part of the request must be mapped with a central unit
+    parts = components([node.id for node in request_nodes], links)
+    central = {parts[node.id] for node in request_nodes
+               if isinstance(node, CentralUnit)}
+    if request_nodes and central == set(parts.values()):
+        pools = {node.id for node in physical.get_nodes()
+                 if node.id in nodes and isinstance(node, CentralUnit)
+                 and any(isinstance(request, CentralUnit)
+                         and fits(request, node) for request in request_nodes)}
+        component = components(sorted(nodes), edges)
+        useful = {component[id] for id in pools}
+        nodes = {id for id in nodes if component[id] in useful}
+        edges = [edge for edge in edges
+                 if edge.source in nodes and edge.target in nodes]
+    ids = sorted(nodes)
+    new = {id: i for i, id in enumerate(ids)}
+    elements = defaultdict(list)
+    for node in physical.get_nodes():
+        if node.id in new:
+            elements['nodes'].append(replace(node, id=new[node.id]))
+    for edge in edges:
+        elements['edges'].append(replace(edge, source=new[edge.source],
+                                         target=new[edge.target]))
+    return Reduction(physical, Topology(elements), ids)
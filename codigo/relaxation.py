@@ -0,0 +1,320 @@
+# coding: utf-8
+"""Linear relaxation bound of the embedding
+
+LPBound builds, for a BranchAndBound, the linear relaxation of the rest
+of the embedding with the variables
+
+- z[n, h] in [0, 1], the request node n is placed on the host h of its
+  domain,
+- x[k, e] in [0, 1], the link k goes through the physical edge e, for the
+  edges with capacity for it,
+- y[e] in [0, 1], the edge e is used by some link,
+
+and the constraints: every request node is placed once, the flow of
+every link leaves the host of its source and arrives to the host of its
+target in at most max_hops edges, the links through an edge fit in its
+bandwith, the nodes on a host fit in its prc (and prb and ant for
+distributed units) and an edge is used only if some flow goes through
+it. The placements, paths and hops of the state fix their variables.
+
+Every embedding below the state is a solution of the relaxation, so with
+U the largest sum of y and C the smallest sum of the bandwith/capacity
+of the flows, cost() <= U / pools * (1 - C / num_links). attach() makes
+bound() return the smaller of this and the bound of BranchAndBound.
+
+The model only depends on the problem, so it is passed to HiGHS once per
+objective, and every state only changes the bounds of the variables
+that differ from the state solved before. HiGHS keeps the basis of the
+last solve, so the siblings and children of a state start from the
+basis of the state before them. Given a function with the incumbent,
+the relaxation is only solved when the bound of BranchAndBound is
+within `margin` of it, since otherwise it cannot cut the state. Without
+one, or before the first solution, it is solved in every state. highspy
+is optional, without it LPBound cannot be built.
+"""
+from collections import OrderedDict, defaultdict
+from time import perf_counter
+
+try:
+    import numpy as np
+    import highspy
+except ImportError:
+    highspy = None
+
+TOLERANCE = 1e-7  # Added to the bounds, to cover the errors of the solver
+
+
+class LPBound:
+    """Relaxation of p, a BranchAndBound at its root
+
+    With max_depth, the relaxation is only solved in the states with at
+    most max_depth nodes placed and links routed, and the deeper ones
+    use the bound of p alone. It is also skipped in the states whose
+    bound is above (1 + margin) times the incumbent, if attach() is given
+    one and it is positive. size is the number of results kept.
+    """
+
+    def __init__(self, p, max_depth=None, size=1 << 16, margin=0.05):
+        if highspy is None:
+            raise Exception("LPBound needs highspy")
+        self.p = p
+        self.max_depth = max_depth
+        self.size = size
+        self.margin = margin
+        self.incumbent = None
+        self.results = OrderedDict()  # State key -> relaxed bound
+        self.stats = defaultdict(float)
+        self.root = None
+        residual = p.residual
+        nodes = p.requests.get_nodes()
+        self.links = p.requests.get_edges()
+        columns = 0
+        # Variables of every kind, by position
+        self.z = dict()  # (request node id, host position) -> column
+        for node in nodes:
+            for host in p.domains[node.id]:
+                self.z[node.id, residual.index[host]] = columns
+                columns += 1
+        self.x = dict()  # (link number, edge position) -> column
+        for k, link in enumerate(self.links):
+            for pos in range(len(residual.edges)):
+                if residual.bandwith[pos] >= link.bandwith:
+                    self.x[k, pos] = columns
+                    columns += 1
+        self.y = dict()  # Edge position -> column
+        for pos in range(len(residual.edges)):
+            self.y[pos] = columns
+            columns += 1
+        self.columns = columns
+        # The same columns grouped by request node, link and edge
+        self.node_columns = defaultdict(list)
+        for (id, pos), column in self.z.items():
+            self.node_columns[id].append(column)
+        self.link_columns = defaultdict(list)
+        edge_columns = defaultdict(list)  # Edge position -> [(link, column)]
+        for (k, pos), column in self.x.items():
+            self.link_columns[k].append(column)
+            edge_columns[pos].append((self.links[k], column))
+        equal, rhs_equal = [], []  # (row, column, value), right hand sides
+        for node in nodes:
+            row = len(rhs_equal)
+            equal += [(row, column, 1) for column in self.node_columns[node.id]]
+            rhs_equal.append(1)
+        flow = dict()  # (link number, node position) -> row
+        for k, link in enumerate(self.links):
+            for pos in range(len(residual.nodes)):
+                flow[k, pos] = len(rhs_equal)
+                rhs_equal.append(0)
+            for (id, pos), column in self.z.items():
+                if id == link.source:
+                    equal.append((flow[k, pos], column, -1))
+                if id == link.target:
+                    equal.append((flow[k, pos], column, 1))
+        for (k, pos), column in self.x.items():
+            equal.append((flow[k, residual.source[pos]], column, 1))
+            equal.append((flow[k, residual.target[pos]], column, -1))
+        upper, rhs_upper = [], []
+        for pos in range(len(residual.edges)):
+            row = len(rhs_upper)
+            upper += [(row, column, link.bandwith)
+                      for link, column in edge_columns[pos]]
+            rhs_upper.append(residual.bandwith[pos])
+            row = len(rhs_upper)
+            upper.append((row, self.y[pos], 1))
+            upper += [(row, column, -1) for link, column in edge_columns[pos]]
+            rhs_upper.append(0)
+        # No path has more hops than p allows, which also keeps the flow
+        # of a link from going around cycles for free
+        for k in range(len(self.links)):
+            row = len(rhs_upper)
+            upper += [(row, column, 1) for column in self.link_columns[k]]
+            rhs_upper.append(p.max_hops)
+        placed = defaultdict(list)  # Host position -> [(node, column)]
+        for (id, pos), column in self.z.items():
+            placed[pos].append((p.requests.get_node_by_id(id), column))
+        for pos, pairs in placed.items():
+            names = ["prc"]
+            if residual.distributed[pos]:
+                names += ["prb", "ant"]
+            for name in names:
+                row = len(rhs_upper)
+                upper += [(row, column, getattr(node, name))
+                          for node, column in pairs]
+                rhs_upper.append(getattr(residual, name)[pos])
+        self.most_edges = np.zeros(columns)
+        self.most_edges[list(self.y.values())] = -1
+        self.least_use = np.zeros(columns)
+        for (k, pos), column in self.x.items():
+            self.least_use[column] = (self.links[k].bandwith
+                                      / residual.capacity[pos])
+        self.flows = np.array(sorted(self.x.values()), dtype=np.int32)
+        # The rows of upper go after the ones of equal
+        rows = len(rhs_equal)
+        entries = sorted(equal + [(rows + row, column, value)
+                                  for row, column, value in upper],
+                         key=lambda entry: (entry[1], entry[0]))
+        lower = rhs_equal + [-highspy.kHighsInf] * len(rhs_upper)
+        self.models = dict()  # Objective -> [Highs, lower, upper bounds]
+        for name, objective in (("edges", self.most_edges),
+                                ("use", self.least_use),
+                                ("both", self.most_edges + self.least_use)):
+            self.models[name] = [self.model(entries, objective, lower,
+                                            rhs_equal + rhs_upper),
+                                 np.zeros(columns), np.ones(columns)]
+
+    def model(self, entries, objective, lower, upper):
+        """Highs minimising objective, with the (row, column, value)
+        entries sorted by column, the rows between lower and upper and
+        the variables in [0, 1]"""
+        start = np.zeros(self.columns + 1, dtype=np.int32)
+        for row, column, value in entries:
+            start[column + 1] += 1
+        lp = highspy.HighsLp()
+        lp.num_col_, lp.num_row_ = self.columns, len(lower)
+        lp.col_cost_ = objective
+        lp.col_lower_ = np.zeros(self.columns)
+        lp.col_upper_ = np.ones(self.columns)
+        lp.row_lower_ = np.array(lower, dtype=float)
+        lp.row_upper_ = np.array(upper, dtype=float)
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = np.cumsum(start, dtype=np.int32)
+        lp.a_matrix_.index_ = np.array([entry[0] for entry in entries],
+                                       dtype=np.int32)
+        lp.a_matrix_.value_ = np.array([entry[2] for entry in entries],
+                                       dtype=float)
+        highs = highspy.Highs()
+        highs.setOptionValue("output_flag", False)
+        highs.passModel(lp)
+        return highs
+
+    def fixed(self):
+        """Lower and upper bounds of the variables in the current state
+        of p"""
+        p, residual = self.p, self.p.residual
+        lower, upper = np.zeros(self.columns), np.ones(self.columns)
+        for id, host in p.hosts.items():
+            upper[self.node_columns[id]] = 0
+            column = self.z[id, residual.index[host]]
+            lower[column] = upper[column] = 1
+        current = p.first_link_unassigned()
+        for k, link in enumerate(self.links):
+            if link not in p.edge_correspondance:
+                continue
+            path = {residual.edge_index[edge.source, edge.target]
+                    for edge in p.edge_correspondance[link]}
+            for pos in path:
+                lower[self.x[k, pos]] = 1
+            if link != current:
+                upper[self.link_columns[k]] = 0
+                for pos in path:
+                    upper[self.x[k, pos]] = 1
+        return lower, upper
+
+    def solve(self, name, bounds):
+        """Optimum of the model name with bounds, None if there is no
+        solution and nan if the solver fails"""
+        highs, lower, upper = self.models[name]
+        changed = np.flatnonzero((lower != bounds[0]) | (upper != bounds[1]))
+        if len(changed):
+            highs.changeColsBounds(len(changed), changed.astype(np.int32),
+                                   bounds[0][changed], bounds[1][changed])
+            lower[changed], upper[changed] = (bounds[0][changed],
+                                              bounds[1][changed])
+        highs.run()
+        self.stats["solves"] += 1
+        self.stats["iterations"] += highs.getInfo().simplex_iteration_count
+        status = highs.getModelStatus()
+        if status == highspy.HighsModelStatus.kInfeasible:
+            return None
+        if status != highspy.HighsModelStatus.kOptimal:
+            return float("nan")
+        return highs.getInfo().objective_function_value
+
+    def relaxed(self):
+        """Bound of the current state from the relaxation, -inf if it has
+        no solution"""
+        p = self.p
+        temp = perf_counter()
+        try:
+            bounds = self.fixed()
+            edges = self.solve("edges", bounds)
+            if edges is None:
+                return float("-inf")
+            use = self.solve("use", bounds)
+            edges, pools, links = -edges, p.num_pools, p.num_links
+            if not edges <= links or not use >= 0:
+                return float("inf")
+            best = edges / pools * (1 - use / links)
+            if edges > 0 and use < links:
+                # Every solution has U - ratio * C <= most, so C is at
+                # least (U - most) / ratio, with ratio the slope of the
+                # cost between U and C at (edges, use)
+                ratio = (links - use) / edges
+                highs = self.models["both"][0]
+                highs.changeColsCost(len(self.flows), self.flows,
+                                     ratio * self.least_use[self.flows])
+                most = -self.solve("both", bounds)
+                if most == most:
+                    corner = min(edges, most + ratio * use)
+                    top = min(max((ratio * links + most) / 2, corner), edges)
+                    best = min(best, max(
+                        u / pools * (1 - max(use, (u - most) / ratio) / links)
+                        for u in (corner, top, edges)))
+            return best + TOLERANCE
+        finally:
+            self.stats["time"] += perf_counter() - temp
+
+    def depth(self):
+        p = self.p
+        return len(p.hosts) + len(p.edge_correspondance)
+
+    def attach(self, p=None, incumbent=None):
+        """Makes bound() of p use the relaxation, incumbent is an optional
+        function that returns the best cost found by the search"""
+        p = self.p if p is None else p
+        bound = p.bound
+        if incumbent is not None:
+            self.incumbent = incumbent
+
+        def tighter():
+            value = bound()
+            if (not p.num_pools or not p.num_links or (
+                    self.max_depth is not None
+                    and self.depth() > self.max_depth)):
+                return value
+            best = 0 if self.incumbent is None else self.incumbent()
+            if best > 0 and value > (1 + self.margin) * best:
+                self.stats["skipped"] += 1
+                return value
+            key = p.state_key()
+            if key in self.results:
+                self.results.move_to_end(key)
+                self.stats["reused"] += 1
+                relaxed = self.results[key]
+            else:
+                relaxed = self.relaxed()
+                self.results[key] = relaxed
+                if len(self.results) > self.size:
+                    self.results.popitem(last=False)
+            if self.root is None and not self.depth():
+                self.root = relaxed
+            if relaxed < value:
+                self.stats["tightened"] += 1
+            return min(value, relaxed)
+
+        p.bound = tighter
+        return p
+
+    def detach(self, p=None):
+        p = self.p if p is None else p
+        p.__dict__.pop("bound", None)
+        return p
+
+    def report(self, best_cost=None):
+        """Counters, the bound at the root, if it was solved there, and,
+        with the cost of the best solution, the gap to it"""
+        report = dict(self.stats)
+        report["root"] = self.root
+        if best_cost is not None and self.root is not None:
+            report["root_gap"] = max(0, self.root - best_cost)
+        return report
@@ -1,7 +1,9 @@
 # coding: utf-8
 from dataclasses import dataclass
 from copy import deepcopy
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from array import array
+import random
 
 
 @dataclass(frozen=True)
@@ -70,12 +72,26 @@ class EdgeVirtual(Edge):
 class Topology:
     """Documentation for Topology
 
+    Besides the sorted lists of nodes and edges, it keeps an index from
+    node id to position, from (source, target) to position and the
+    positions of the edges leaving every node, so lookups are O(1).
     """
 
     def __init__(self, dictionary):
         self.dictionary = dictionary
         self.dictionary["nodes"] = sorted(self.dictionary["nodes"])
         self.dictionary["edges"] = sorted(self.dictionary["edges"])
+        self.reindex()
+
+    def reindex(self):
+        """Rebuilds the indexes, needed if the lists are changed directly"""
+        self.node_index = {node.id: pos
+                           for pos, node in enumerate(self.get_nodes())}
+        self.edge_index = dict()
+        self.adjacency = defaultdict(list)
+        for pos, edge in enumerate(self.get_edges()):
+            self.edge_index[(edge.source, edge.target)] = pos
+            self.adjacency[edge.source].append(pos)
 
     def get_nodes(self):
         return self.dictionary["nodes"]
@@ -84,56 +100,401 @@ class Topology:
         return self.dictionary["edges"]
 
     def get_node_by_id(self, id):
-        for i in self.get_nodes():
-            if i.id == id:
-                return i
+        pos = self.node_index.get(id)
+        if pos is not None:
+            return self.dictionary["nodes"][pos]
+
+    def get_edge(self, source, target):
+        pos = self.edge_index.get((source, target))
+        if pos is not None:
+            return self.dictionary["edges"][pos]
 
     def get_edge_by_source(self, source):
-        for i in self.get_edges():
-            if i.source == source:
-                yield i
+        edges = self.dictionary["edges"]
+        for pos in self.adjacency.get(source, ()):
+            yield edges[pos]
 
     def modify_edge_by_id(self, new_edge):
-        for pos, i in enumerate(self.get_edges()):
-            if i.source  == new_edge.source and i.target == new_edge.target:
-                break
-        else:
+        pos = self.edge_index.get((new_edge.source, new_edge.target))
+        if pos is None:
             raise Exception("Edge not found")
         self.dictionary["edges"][pos] = new_edge
 
     def modify_node_by_id(self, new_node):
-        for pos, i in enumerate(self.get_nodes()):
-            if i.id == new_node.id:
-                break
-        else:
+        pos = self.node_index.get(new_node.id)
+        if pos is None:
             raise Exception("Node not found")
         self.dictionary["nodes"][pos] = new_node
 
 
+class ResidualNetwork:
+    """Residual capacities of a physical network in flat arrays
+
+    Nodes and edges are addressed by their position. prc, prb, ant and
+    bandwith hold the residual values and capacity the original bandwith.
+    The edges leaving the node in position i are the positions from
+    offsets[i] to offsets[i + 1] - 1 and their ends are in source and
+    target (CSR adjacency), so a capacity change is a write in an array.
+    """
+
+    def __init__(self, nodes, edges, typecode=None):
+        self.nodes = sorted(nodes)
+        self.index = {node.id: pos for pos, node in enumerate(self.nodes)}
+        self.edges = sorted(edges, key=lambda edge: (self.index[edge.source],
+                                                     self.index[edge.target]))
+        self.edge_index = {(edge.source, edge.target): pos
+                           for pos, edge in enumerate(self.edges)}
+
+        def column(values):
+            code = typecode or ('q' if all(isinstance(i, int) for i in values)
+                                else 'd')
+            return array(code, values)
+
+        self.distributed = array('b', [isinstance(node, DistributedUnit)
+                                       for node in self.nodes])
+        self.prc = column([node.prc for node in self.nodes])
+        self.prb = column([getattr(node, "prb", 0) for node in self.nodes])
+        self.ant = column([getattr(node, "ant", 0) for node in self.nodes])
+        self.bandwith = column([edge.bandwith for edge in self.edges])
+        self.capacity = array(self.bandwith.typecode, self.bandwith)
+        self.source = array('q', [self.index[edge.source] for edge in self.edges])
+        self.target = array('q', [self.index[edge.target] for edge in self.edges])
+        self.offsets = array('q', [0] * (len(self.nodes) + 1))
+        for pos in self.source:
+            self.offsets[pos + 1] += 1
+        for pos in range(len(self.nodes)):
+            self.offsets[pos + 1] += self.offsets[pos]
+
+    @classmethod
+    def from_topology(cls, topology, typecode=None):
+        return cls(topology.get_nodes(), topology.get_edges(), typecode)
+
+    def node(self, pos):
+        """Node in pos with its residual capacity"""
+        node = self.nodes[pos]
+        if self.distributed[pos]:
+            return DistributedUnit(node.id, node.label, node.x, node.y,
+                                   self.prc[pos], self.prb[pos],
+                                   self.ant[pos], node.theta)
+        return CentralUnit(node.id, node.label, node.x, node.y, self.prc[pos])
+
+    def edge(self, pos):
+        """Edge in pos with its residual bandwith"""
+        edge = self.edges[pos]
+        return EdgePhysical(edge.source, edge.target, self.bandwith[pos],
+                            edge.distance, edge.type)
+
+    def to_topology(self):
+        return Topology({"nodes": [self.node(pos)
+                                   for pos in range(len(self.nodes))],
+                         "edges": [self.edge(pos)
+                                   for pos in range(len(self.edges))]})
+
+    def out_edges(self, pos):
+        return range(self.offsets[pos], self.offsets[pos + 1])
+
+    def fits(self, node, pos):
+        """Checks if the request node fits in the residual node in pos"""
+        if isinstance(node, DistributedUnit):
+            return (self.distributed[pos] and node.prc <= self.prc[pos]
+                    and node.prb <= self.prb[pos] and node.ant <= self.ant[pos])
+        return not self.distributed[pos] and node.prc <= self.prc[pos]
+
+    def place(self, node, pos, sign=1):
+        """Takes (or gives back, with sign -1) the demand of node in pos"""
+        self.prc[pos] -= sign * node.prc
+        if self.distributed[pos]:
+            self.prb[pos] -= sign * node.prb
+            self.ant[pos] -= sign * node.ant
+
+
+def fits(node, host):
+    """Checks if the request node can be placed in the physical host"""
+    if isinstance(node, DistributedUnit):
+        return (isinstance(host, DistributedUnit) and node.prc <= host.prc
+                and node.prb <= host.prb and node.ant <= host.ant)
+    return isinstance(host, CentralUnit) and node.prc <= host.prc
+
+
+def host_classes(topology, delays=False):
+    """Groups the physical nodes that can be swapped without changing
+    any solution cost
+
+    Two hosts are interchangeable when they have the same type and
+    capacities and the same bandwith to every other node, so swapping
+    them maps the network onto itself. With delays, the edges must have
+    the same distance too, so swapping them keeps the delay of every
+    path. Returns a dict from the id of every host with some twin to the
+    number of its class.
+    """
+    links = defaultdict(dict)
+    for edge in topology.get_edges():
+        links[edge.source][edge.target] = ((edge.bandwith, edge.distance)
+                                           if delays else edge.bandwith)
+    groups = defaultdict(list)  # Signature -> representatives of classes
+    classes = dict()
+    members = defaultdict(list)
+    for node in sorted(topology.get_nodes()):
+        signature = (isinstance(node, DistributedUnit), node.prc,
+                     getattr(node, "prb", 0), getattr(node, "ant", 0),
+                     tuple(sorted(links[node.id].values())))
+        for other in groups[signature]:
+            mine = {k: v for k, v in links[node.id].items() if k != other}
+            theirs = {k: v for k, v in links[other].items() if k != node.id}
+            if (mine == theirs and links[node.id].get(other)
+                    == links[other].get(node.id)):
+                classes[node.id] = classes[other]
+                break
+        else:
+            groups[signature].append(node.id)
+            classes[node.id] = len(members)
+        members[classes[node.id]].append(node.id)
+    return {id: number for id, number in classes.items()
+            if len(members[number]) > 1}
+
+
+# Ways of ordering the candidate hosts of a request node, from the key of
+# the host that is tried first
+HOST_ORDERS = {
+    "id": lambda node, host: host.id,
+    "best_fit": lambda node, host: (host.prc - node.prc, host.id),
+    "worst_fit": lambda node, host: (node.prc - host.prc, host.id),
+}
+
+
+@dataclass
+class Solution:
+    """Snapshot of the correspondences of a complete assignment"""
+    node_correspondance: dict
+    edge_correspondance: dict
+    cost: float
+
+
+class TranspositionTable:
+    """Bounded set of the state keys already expanded, the least recently
+    seen key is dropped first when it is full"""
+
+    def __init__(self, size=1 << 20):
+        self.size = size
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def seen(self, key):
+        """Checks if key was stored and stores it"""
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.keys[key] = None
+        if len(self.keys) > self.size:
+            self.keys.popitem(last=False)
+            self.evictions += 1
+        return False
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.keys)}
+
+
 class BranchAndBound:
     """Documentation for BranchAndBound
 
+    The search state is modified in place. Every change made by apply()
+    pushes an undo record on self.trail, and undo(mark) pops the records
+    until the trail has length mark again, so a child state costs only
+    the size of the change instead of a deepcopy of the whole problem.
+    The residual capacities live in a ResidualNetwork and the
+    correspondences point to the nodes and edges of the original network.
+
+    Links are routed one hop per move, unless paths is a PathCatalogue
+    (see paths.py) of the same physical network, and then with one move
+    per path of the catalogue.
+
+    With symmetry, the hosts of every class of host_classes() that are
+    still untouched (nothing placed on them and no hop on their edges)
+    are equivalent, and moves() only offers the first one of them. classes
+    can be given to skip computing them, with the distances of the edges
+    if distances is given.
+
+    residual is an optional ResidualNetwork of physical shared with other
+    searches, for example with the capacity left by the requests embedded
+    before (see online.py). The search starts from its capacities and
+    leaves them as they were, and physical is not copied.
+
+    num_links is the number of edges of the network UoC is averaged over,
+    all the edges of physical by default. A reduced network (see
+    reduction.py) passes the number of edges of the whole one.
+
+    distances is an optional DistanceMatrix of physical (see distances.py)
+    that makes the delay of every link a budget on the sum of the
+    distances of its path. A node is not placed where a link to a placed
+    neighbour could not arrive in time, a hop is dropped when the delay
+    of the path so far, of the hop and of the fastest way left to the
+    host of the target exceed the budget, and the hops are tried in order
+    of the hops left to that host.
     """
 
-    def __init__(self, physical, requests):
+    def __init__(self, physical, requests, order="id", paths=None,
+                 symmetry=True, residual=None, classes=None, num_links=None,
+                 distances=None):
         self.node_correspondance = defaultdict(list)
         self.edge_correspondance = dict()
-        self.original = deepcopy(physical)
-        self.physical = deepcopy(physical)  # This is going to be modified
+        self.original = deepcopy(physical) if residual is None else physical
         self.requests = deepcopy(requests)
+        demands = [getattr(node, name, 0) for node in self.requests.get_nodes()
+                   for name in ("prc", "prb", "ant")]
+        demands += [link.bandwith for link in self.requests.get_edges()]
+        typecode = None if all(isinstance(i, int) for i in demands) else 'd'
+        # This is going to be modified
+        if residual is None:
+            residual = ResidualNetwork.from_topology(self.original, typecode)
+        self.residual = residual
+        self.trail = []
         self.initialize_connect()
+        # Incremental terms of the cost, kept up to date by apply/undo
+        self.hosts = dict()  # Request node id -> physical node id
+        self.edge_use = defaultdict(int)  # Edge position -> hops on it
+        self.used_edges = 0
+        self.used_capacity = 0
+        self.pools = 0
+        self.num_links = (len(self.original.get_edges()) if num_links is None
+                          else num_links)
+        self.num_pools = sum(1 for node in self.requests.get_nodes()
+                             if isinstance(node, CentralUnit))
+        self.max_hops = len(self.original.get_nodes()) - 1
+        self.paths = paths
+        if paths is not None:
+            self.max_hops = min(self.max_hops, paths.longest())
+        self.widest = max((edge.bandwith for edge in self.original.get_edges()),
+                          default=0)
+        self.initialize_domains(order)
+        self.initialize_zobrist()
+        self.initialize_distances(distances)
+        if classes is None:
+            classes = (host_classes(self.original, distances is not None)
+                       if symmetry else dict())
+        self.host_class = {self.residual.index[id]: number
+                           for id, number in classes.items() if symmetry}
+        # Placements and hops on every host, by position, with the capacity
+        # already taken from a shared residual network counted once
+        self.touched = array('q', [0] * len(self.residual.nodes))
+        if self.host_class:
+            residual = self.residual
+            for pos, node in enumerate(residual.nodes):
+                if (residual.prc[pos] != node.prc or residual.prb[pos]
+                        != getattr(node, "prb", 0) or residual.ant[pos]
+                        != getattr(node, "ant", 0)):
+                    self.touched[pos] = 1
+            for pos in range(len(residual.edges)):
+                if residual.bandwith[pos] != residual.capacity[pos]:
+                    self.touched[residual.source[pos]] = 1
+                    self.touched[residual.target[pos]] = 1
+
+    def initialize_domains(self, order):
+        """Computes the candidate hosts of every request node once
+
+        order is a key of HOST_ORDERS or a function (node, host) -> key.
+        During the search, removed[id] holds the hosts of the domain of the
+        request node id that no longer fit, and wiped counts the
+        unassigned request nodes left without any host.
+        """
+        key = HOST_ORDERS[order] if isinstance(order, str) else order
+        self.domains = dict()
+        self.watchers = defaultdict(list)  # Host id -> request node ids
+        residual = self.residual
+        hosts = [residual.node(pos) for pos in range(len(residual.nodes))]
+        for node in self.requests.get_nodes():
+            domain = [host for host in hosts if fits(node, host)]
+            domain.sort(key=lambda host: key(node, host))
+            self.domains[node.id] = [host.id for host in domain]
+            for host in domain:
+                self.watchers[host.id].append(node)
+        self.removed = {node_id: set() for node_id in self.domains}
+        self.wiped = sum(1 for domain in self.domains.values() if not domain)
+
+    def initialize_distances(self, distances):
+        """Row of every residual position in distances and the links of
+        every request node, with the other end, to check their delays"""
+        self.distances = distances
+        if distances is None:
+            return
+        self.rows = array('q', [distances.index[node.id]
+                                for node in self.residual.nodes])
+        self.node_links = defaultdict(list)
+        for link in self.requests.get_edges():
+            self.node_links[link.source].append((link, link.target))
+            self.node_links[link.target].append((link, link.source))
+
+    def remaining(self, pos, goal):
+        """Shortest delay from the residual position pos to goal"""
+        distances = self.distances
+        return distances.delays[self.rows[pos] * distances.size
+                                + self.rows[goal]]
+
+    def path_delay(self, link):
+        """Sum of the distances of the edges of the path of link so far"""
+        return sum(edge.distance
+                   for edge in self.edge_correspondance.get(link, ()))
+
+    def in_time(self, node, pos):
+        """Checks if every link between node, placed in the residual
+        position pos, and a placed node can still meet its delay"""
+        index = self.residual.index
+        for link, other in self.node_links[node.id]:
+            if other in self.hosts and self.remaining(
+                    pos, index[self.hosts[other]]) > link.delay:
+                return False
+        return True
+
+    def initialize_zobrist(self):
+        """Random keys of the incremental hash of the state
+
+        Placing a request node adds the key of the node and its host, and
+        every edge in use adds the key of its position and residual
+        bandwith, so the hash does not depend on which links use an edge.
+        """
+        self.link_number = {link: i for i, link
+                            in enumerate(self.requests.get_edges())}
+        generator = random.Random(0)
+        self.zobrist_keys = defaultdict(lambda: generator.getrandbits(64))
+        self.zobrist = 0
+
+    def state_key(self):
+        """Hash of everything the completions of the state depend on
+
+        Besides the placements and the residual network, which give the
+        terms of the cost, it has the link being routed and its hops. Two
+        orders of routing the links that leave the same residual network
+        have the same key, their best completions have the same cost.
+        """
+        link = self.first_link_unassigned()
+        if link is None:
+            return self.zobrist
+        key = self.zobrist ^ self.zobrist_keys[('link', self.link_number[link])]
+        for edge in self.edge_correspondance.get(link, ()):
+            key ^= self.zobrist_keys[('hop', edge.source, edge.target)]
+        return key
+
+    def feasible(self):
+        return not self.wiped
+
+    @property
+    def physical(self):
+        """Topology with the residual capacities"""
+        return self.residual.to_topology()
 
     def initialize_connect(self):
+        # Nodes that are not in connect_dict are their own root with size 1
         self.connect_dict = dict()
         self.size = dict()
-        for node in self.physical.get_nodes():
-            self.connect_dict[node.id] = node.id
-            self.size[node.id] = 1
 
     def root(self, id):
-        temp = self.connect_dict[id]
+        temp = self.connect_dict.get(id, id)
         while temp != id:
-            temp, id = self.connect_dict[temp], temp
+            temp, id = self.connect_dict.get(temp, temp), temp
         return temp
 
     def is_connected(self, id1, id2):
@@ -142,16 +503,15 @@ class BranchAndBound:
     def connect(self, id1, id2):
         root1 = self.root(id1)
         root2 = self.root(id2)
-        if self.size[root1] > self.size[root2]:
-            self.connect_dict[root2] = root1
-            self.size[root1] += self.size[root2]
-        else:
-            self.connect_dict[root1] = root2
-            self.size[root2] += self.size[root1]
+        if self.size.get(root1, 1) > self.size.get(root2, 1):
+            root1, root2 = root2, root1
+        self.connect_dict[root1] = root2
+        self.size[root2] = self.size.get(root2, 1) + self.size.get(root1, 1)
+        return root1, root2
 
     def first_node_unassigned(self):
         for node in self.requests.get_nodes():
-            if node not in self.node_correspondance:
+            if node.id not in self.hosts:
                 return node
         else:
             return None
@@ -161,105 +521,281 @@ class BranchAndBound:
             if link not in self.edge_correspondance:
                 return link
             path = self.edge_correspondance[link]
-            a, b = link.source, link.target
-            for temp1, temp2 in self.node_correspondance.items():
-                if temp1.id == a:
-                    a = temp2.id
-                    break
-            for temp1, temp2 in self.node_correspondance.items():
-                if temp1.id == b:
-                    b = temp2.id
-                    break
+            a = self.hosts.get(link.source, link.source)
+            b = self.hosts.get(link.target, link.target)
             if not path or path[0].source != a or path[-1].target != b:
                 return link
         return None
 
     def is_assigned(self):
+        # Every link must have a path that ends in the host of its target,
+        # not only an entry in edge_correspondance, which it has from its
+        # first hop on (see test_partial_path_is_not_assigned)
         return ( len(self.node_correspondance.keys()) == len(self.requests.get_nodes())
                  and
                  len(self.edge_correspondance.keys()) == len(self.requests.get_edges())
+                 and
+                 self.first_link_unassigned() is None
                  )
+
     def DoC(self):
-        Agk = set()
-        for link, path in self.edge_correspondance.items():
-            Agk.update(set(path))
-        Pools = 0
-        for node in self.node_correspondance.values():
-            if isinstance(node, CentralUnit):
-                Pools += 1
-        return len(Agk)/Pools
+        # Number of different physical edges in the paths over the pools
+        return self.used_edges / self.pools
 
     def UoC(self):
-        used_capacity = 0
-        num_links = 0
-        for link1, link2 in zip(sorted(self.original.get_edges()),
-                                sorted(self.physical.get_edges())):
-            num_links += 1
-            # The formula is the capacity minus the remainder
-            used_capacity += 1 - link2.bandwith/link1.bandwith
-        return used_capacity / num_links
+        # The formula is the capacity minus the remainder, averaged over
+        # all edges; used_capacity holds the sum of 1 - remainder/capacity
+        return self.used_capacity / self.num_links
 
     def cost(self):
         return self.DoC() * (1 - self.UoC())
 
-    def expand(self):
-        for node in self.requests.get_nodes():
-            if any(node.id <= i.id for i in self.node_correspondance):
+    def bound(self):
+        """Optimistic upper bound on cost() of any completion of this state
+
+        Every link not routed yet needs at least one more hop and no path
+        has more hops than nodes in the network. Each hop adds at most one
+        edge to DoC, never more than the edges of the network, and at least
+        bandwith/max(original bandwith) to the used capacity of UoC, so the
+        best completion is the maximum of a concave quadratic in the
+        number of extra hops.
+        """
+        links = self.requests.get_edges()
+        num_links, pools = self.num_links, self.num_pools
+        if not links or not num_links or not pools:
+            return self.cost() if self.is_assigned() else float("inf")
+        max_hops, widest = self.max_hops, self.widest
+        used_edges, used_capacity = self.used_edges, self.used_capacity
+        # Links are routed in order, so the ones before the first
+        # unassigned link are complete and the rest still need a hop,
+        # but the ones after it with a path were given complete (see
+        # lns.py)
+        current = self.first_link_unassigned()
+        low, high, step = 0, 0, None
+        for link in links:
+            if link != current and link in self.edge_correspondance:
                 continue
-            for target in self.physical.get_nodes():
-                aux = deepcopy(self)
-                if node.prc <= target.prc:
-                    if isinstance(node, DistributedUnit) and isinstance(target, DistributedUnit):
-
-                        if (node.prb <= target.prb) and (node.ant <= target.ant):
-                            target_aux = DistributedUnit(target.id,
-                                                         target.label,
-                                                         target.x,
-                                                         target.y,
-                                                         target.prc - node.prc,
-                                                         target.prb - node.prb,
-                                                         target.ant - node.ant,
-                                                         target.theta)
-                            aux.physical.modify_node_by_id(target_aux)
-                            aux.node_correspondance[node] = target_aux
-                            yield aux
-                    elif isinstance(node, CentralUnit) and isinstance(target, CentralUnit):
-                        target_aux = CentralUnit(target.id,
-                                                 target.label,
-                                                 target.x,
-                                                 target.y,
-                                                 target.prc - node.prc)
-                        aux.physical.modify_node_by_id(target_aux)
-                        aux.node_correspondance[node] = target_aux
-                        yield aux
-        if len(self.node_correspondance.keys()) == len(self.requests.get_nodes()):
-            link = self.first_link_unassigned()
-            initial, destiny = 0, 0
+            ratio = link.bandwith / widest
+            low += 1
+            high += max_hops - len(self.edge_correspondance.get(link, ()))
+            used_capacity += ratio
+            step = ratio if step is None else min(step, ratio)
+        if step is None:
+            return used_edges / pools * (1 - used_capacity / num_links)
+
+        def completion(hops):
+            return (min(used_edges + hops, num_links) / pools
+                    * (1 - (used_capacity + (hops - low) * step) / num_links))
+
+        candidates = [low, high, num_links - used_edges]
+        if step > 0:
+            candidates.append((num_links - used_capacity + low * step
+                               - used_edges * step) / (2 * step))
+        return max(completion(min(max(hops, low), high))
+                   for hops in candidates)
+
+    def mark(self):
+        return len(self.trail)
+
+    def undo(self, mark):
+        while len(self.trail) > mark:
+            record = self.trail.pop()
+            kind = record[0]
+            if kind == 'node':
+                self.residual.place(record[1], record[2], -1)
+                self.touched[record[2]] -= 1
+                del self.node_correspondance[record[1]]
+                del self.hosts[record[1].id]
+                if not self.residual.distributed[record[2]]:
+                    self.pools -= 1
+                self.zobrist ^= self.zobrist_keys[
+                    ('node', record[1].id, record[2])]
+            elif kind == 'domain':
+                removed = self.removed[record[1]]
+                if len(removed) == len(self.domains[record[1]]):
+                    self.wiped -= 1
+                removed.discard(record[2])
+            elif kind == 'hop':
+                self.zobrist ^= self.zobrist_keys[
+                    ('edge', record[2], self.residual.bandwith[record[2]])]
+                self.residual.bandwith[record[2]] += record[1].bandwith
+                self.touched[self.residual.source[record[2]]] -= 1
+                self.touched[self.residual.target[record[2]]] -= 1
+                self.edge_correspondance[record[1]].pop()
+                self.used_capacity = record[3]
+                self.edge_use[record[2]] -= 1
+                if not self.edge_use[record[2]]:
+                    del self.edge_use[record[2]]
+                    self.used_edges -= 1
+                else:
+                    self.zobrist ^= self.zobrist_keys[
+                        ('edge', record[2], self.residual.bandwith[record[2]])]
+            elif kind == 'path':
+                del self.edge_correspondance[record[1]]
+            elif kind == 'merge':
+                root1, root2 = record[1], record[2]
+                del self.connect_dict[root1]
+                self.size[root2] -= self.size.get(root1, 1)
+            elif kind == 'connect':
+                self.connect_dict, self.size = record[1], record[2]
+            else:
+                raise Exception(f"Unknown trail record {kind}")
+
+    def apply(self, move):
+        """Applies a move returned by moves() and records how to undo it
+
+        A move is either ('node', request id, physical id),
+        ('link', request source, request target, physical source,
+        physical target) or ('path', request source, request target,
+        physical ids of the path), which is the same as a link move for
+        every hop.
+        """
+        if move[0] == 'node':
+            _, node_id, target_id = move
+            node = self.requests.get_node_by_id(node_id)
+            pos = self.residual.index[target_id]
+            self.residual.place(node, pos)
+            self.touched[pos] += 1
+            self.node_correspondance[node] = self.residual.nodes[pos]
+            self.hosts[node.id] = target_id
+            if not self.residual.distributed[pos]:
+                self.pools += 1
+            self.zobrist ^= self.zobrist_keys[('node', node.id, pos)]
+            self.trail.append(('node', node, pos))
+            self.forward_check(pos)
+        elif move[0] == 'link':
+            _, link_source, link_target, source, target = move
+            link = self.requests.get_edge(link_source, link_target)
+            pos = self.residual.edge_index.get((source, target))
+            if link is None or pos is None:
+                raise Exception("Edge not found")
             if link not in self.edge_correspondance:
+                self.trail.append(('connect', self.connect_dict, self.size))
                 self.initialize_connect()
-                a = link.source
-                for temp1, temp2 in self.node_correspondance.items():
-                    if temp1.id == a:
-                        a = temp2
-                        break
-                else:
+                self.edge_correspondance[link] = []
+                self.trail.append(('path', link))
+            if self.edge_use[pos]:
+                self.zobrist ^= self.zobrist_keys[
+                    ('edge', pos, self.residual.bandwith[pos])]
+            self.residual.bandwith[pos] -= link.bandwith
+            self.touched[self.residual.source[pos]] += 1
+            self.touched[self.residual.target[pos]] += 1
+            self.zobrist ^= self.zobrist_keys[
+                ('edge', pos, self.residual.bandwith[pos])]
+            self.edge_correspondance[link].append(self.residual.edges[pos])
+            self.trail.append(('hop', link, pos, self.used_capacity))
+            self.used_capacity += link.bandwith / self.residual.capacity[pos]
+            if not self.edge_use[pos]:
+                self.used_edges += 1
+            self.edge_use[pos] += 1
+            self.trail.append(('merge',) + self.connect(source, target))
+        elif move[0] == 'path':
+            _, link_source, link_target, hosts = move
+            for source, target in zip(hosts, hosts[1:]):
+                self.apply(('link', link_source, link_target, source, target))
+        else:
+            raise Exception(f"Unknown move {move[0]}")
+
+    def forward_check(self, pos):
+        """Removes the host in pos from the domains of the unassigned
+        request nodes that do not fit in its residual capacity any more"""
+        host = self.residual.nodes[pos].id
+        for node in self.watchers[host]:
+            removed = self.removed[node.id]
+            if (node.id in self.hosts or host in removed
+                    or self.residual.fits(node, pos)):
+                continue
+            removed.add(host)
+            self.trail.append(('domain', node.id, host))
+            if len(removed) == len(self.domains[node.id]):
+                self.wiped += 1
+
+    def symmetric(self, pos, seen):
+        """Checks if the host in pos is an untouched twin of a host in
+        seen, the classes offered already, and adds its class if not"""
+        number = self.host_class.get(pos)
+        if number is None or self.touched[pos]:
+            return False
+        if number in seen:
+            return True
+        seen.add(number)
+        return False
+
+    def moves(self):
+        result = []
+        if self.wiped:
+            return result
+        seen = set()
+        # Request nodes are placed in order, one per level of the tree
+        node = self.first_node_unassigned()
+        if node is not None:
+            removed = self.removed[node.id]
+            for target in self.domains[node.id]:
+                pos = self.residual.index[target]
+                if (target not in removed and not self.symmetric(pos, seen)
+                        and (self.distances is None or self.in_time(node, pos))):
+                    result.append(('node', node.id, target))
+        else:
+            link = self.first_link_unassigned()
+            if self.paths is not None and link not in self.edge_correspondance:
+                residual = self.residual
+                for hosts, edges in self.paths.get(self.hosts[link.source],
+                                                   self.hosts[link.target]):
+                    if self.distances is not None and sum(
+                            residual.edges[pos].distance
+                            for pos in edges) > link.delay:
+                        continue
+                    if all(link.bandwith <= residual.bandwith[pos]
+                           for pos in edges):
+                        result.append(('path', link.source, link.target,
+                                       hosts))
+                return result
+            if link not in self.edge_correspondance:
+                if link.source not in self.hosts:
                     raise Exception("Not found end")
-                initial = a.id
+                initial = self.hosts[link.source]
             else:
                 initial = self.edge_correspondance[link][-1].target
-            for temp in self.physical.get_edge_by_source(initial):
-                if (not self.is_connected(initial, temp.target) and link.bandwith <= temp.bandwith):
-                    aux = deepcopy(self)
-                    temp1 = EdgePhysical(temp.source,
-                                         temp.target,
-                                         temp.bandwith - link.bandwith,
-                                         temp.distance,
-                                         temp.type)
-                    if link not in self.edge_correspondance:
-                        aux.edge_correspondance[link] = [temp1]
-                    else:
-                        aux.edge_correspondance[link] += [temp1]
-                    destiny = temp.target
-                    aux.connect(initial, destiny)
-                    aux.physical.modify_edge_by_id(temp1)
-                    yield aux
+            started = link in self.edge_correspondance
+            residual = self.residual
+            if self.distances is not None:
+                goal = residual.index[self.hosts[link.target]]
+                budget = link.delay - self.path_delay(link)
+                hops = dict()  # Target id -> hops left to goal
+            for pos in residual.out_edges(residual.index[initial]):
+                target = residual.nodes[residual.target[pos]].id
+                if started and self.is_connected(initial, target):
+                    continue
+                if self.symmetric(residual.target[pos], seen):
+                    continue
+                if link.bandwith > residual.bandwith[pos]:
+                    continue
+                if self.distances is not None:
+                    if (residual.edges[pos].distance + self.remaining(
+                            residual.target[pos], goal) > budget):
+                        continue
+                    distances = self.distances
+                    hops[target] = distances.hops[
+                        self.rows[residual.target[pos]] * distances.size
+                        + self.rows[goal]]
+                result.append(('link', link.source, link.target,
+                               initial, target))
+            if self.distances is not None:
+                # Stable, so the order of the edges breaks the ties
+                result.sort(key=lambda move: hops[move[4]])
+        return result
+
+    def expand(self):
+        for move in self.moves():
+            mark = self.mark()
+            self.apply(move)
+            try:
+                yield self
+            finally:
+                self.undo(mark)
+
+    def solution(self):
+        return Solution(dict(self.node_correspondance),
+                        {link: list(path)
+                         for link, path in self.edge_correspondance.items()},
+                        self.cost())
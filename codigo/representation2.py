@@ -247,7 +247,7 @@ class BranchAndBound:
                     temp1 = EdgePhysical(temp.source,
                                          temp.target,
                                          temp.bandwidth - link.bandwidth,
-                                         temp.distance,
+                                         temp.delay,
                                          temp.type)
                     if link not in self.edge_correspondance:
                         aux.edge_correspondance[link] = [temp1]
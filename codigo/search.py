@@ -0,0 +1,462 @@
+# coding: utf-8
+"""Iterative branch and bound drivers
+
+Search replaces the recursion of start() in BB.py by an explicit stack
+with the moves still to try at every depth. The moves are plain tuples,
+so the stack, the moves applied to reach the current state and the
+incumbent can be written to a checkpoint file and the search resumed
+later on a new BranchAndBound of the same instance.
+
+BestFirst and Beam explore the states in order of their bound. All the
+drivers stop at a budget of states or seconds, keep the best solution
+found so far and report the gap between it and the best bound of the
+states not explored yet.
+"""
+import argparse
+import heapq
+import json
+import os
+import pickle
+import signal
+from collections import Counter
+from itertools import count
+from time import time
+
+from representation import *
+
+
+class Driver:
+    """Incumbent, counters and current path shared by the drivers
+
+    table is an optional TranspositionTable, the states whose key is in it
+    are not expanded again. profiler is an optional Profiler of
+    instrument.py, it is attached to p and reports the counters of the
+    driver.
+    """
+
+    def __init__(self, p, sol=None, best_cost=0, stats=None, table=None,
+                 profiler=None):
+        self.p = p
+        self.sol, self.best_cost = sol, best_cost
+        self.stats = Counter() if stats is None else stats
+        self.table = table
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.stats = self.stats
+            profiler.attach(p)
+        self.path = []
+        self.marks = []
+        self.paused = False
+
+    def evaluate(self):
+        """Evaluates the current state
+
+        Leaves update the incumbent. Returns the bound of the state if it
+        has to be expanded and None if it is a leaf or is cut.
+        """
+        p, stats = self.p, self.stats
+        if p.is_assigned():
+            stats["leaves"] += 1
+            ct = p.cost()
+            if ct > self.best_cost:
+                self.sol, self.best_cost = p.solution(), ct
+        elif not p.feasible():
+            stats["infeasible"] += 1
+        else:
+            bound = p.bound()
+            if bound <= self.best_cost:
+                stats["pruned"] += 1
+            elif self.table is not None and self.table.seen(p.state_key()):
+                stats["transpositions"] += 1
+            else:
+                return bound
+        return None
+
+    def goto(self, path):
+        """Moves p to the state reached with path, undoing only the moves
+        that are not shared with the current one"""
+        common = 0
+        while (common < len(path) and common < len(self.path)
+               and path[common] == self.path[common]):
+            common += 1
+        if common < len(self.path):
+            self.p.undo(self.marks[common])
+            del self.marks[common:], self.path[common:]
+        for move in path[common:]:
+            self.marks.append(self.p.mark())
+            self.p.apply(move)
+            self.path.append(move)
+
+    def gap(self):
+        """Proven distance from the incumbent to the optimum"""
+        return max(0, self.upper() - self.best_cost)
+
+    def pause(self):
+        """Makes run() return after the current step, safe in a signal
+        handler"""
+        self.paused = True
+
+
+class Search(Driver):
+    """Depth first branch and bound over a BranchAndBound state
+
+    It visits the same states in the same order as start(). stack[i]
+    holds the moves not tried yet from the state reached with path[:i],
+    in reverse order so the next one is at the end, and bounds[i] the
+    bound of that state.
+    """
+
+    def __init__(self, p, sol=None, best_cost=0, stats=None, table=None,
+                 profiler=None):
+        super().__init__(p, sol, best_cost, stats, table, profiler)
+        self.stack = []
+        self.bounds = []
+        self.started = False
+
+    @property
+    def done(self):
+        return self.started and not self.stack
+
+    def visit(self):
+        """Evaluates the current state, returns True if it is expanded"""
+        bound = self.evaluate()
+        if bound is None:
+            return False
+        self.stats["expanded"] += 1
+        self.stack.append(self.p.moves()[::-1])
+        self.bounds.append(bound)
+        if self.profiler is not None:
+            self.profiler.frontier(sum(len(frame) for frame in self.stack))
+        return True
+
+    def upper(self):
+        return max([bound for bound, frame in zip(self.bounds, self.stack)
+                    if frame] + [self.best_cost])
+
+    def run(self, max_nodes=None, max_time=None, checkpoint=None, every=None):
+        """Searches until the tree is exhausted, pause() is called or a
+        limit on new states or seconds is reached
+
+        If checkpoint is a file name, the state is saved there when run()
+        returns and every `every` seconds. Returns the best solution found
+        so far and its cost.
+        """
+        p = self.p
+        self.paused = False
+        temp = last = time()
+        if not self.started:
+            self.started = True
+            self.visit()
+        nodes = 0
+        while self.stack and not self.paused:
+            if max_nodes is not None and nodes >= max_nodes:
+                break
+            if max_time is not None and time() - temp >= max_time:
+                break
+            if checkpoint and every and time() - last >= every:
+                self.save(checkpoint)
+                last = time()
+            frame = self.stack[-1]
+            if not frame:
+                self.stack.pop()
+                self.bounds.pop()
+                if self.path:
+                    p.undo(self.marks.pop())
+                    self.path.pop()
+                continue
+            move = frame.pop()
+            self.marks.append(p.mark())
+            p.apply(move)
+            self.path.append(move)
+            nodes += 1
+            if not self.visit():
+                p.undo(self.marks.pop())
+                self.path.pop()
+        if checkpoint:
+            self.save(checkpoint)
+        return self.sol, self.best_cost
+
+    def save(self, checkpoint):
+        state = {"path": self.path, "stack": self.stack,
+                 "bounds": self.bounds, "sol": self.sol,
+                 "best_cost": self.best_cost, "stats": self.stats,
+                 "started": self.started}
+        temp = f"{checkpoint}.{os.getpid()}"
+        with open(temp, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(temp, checkpoint)
+
+    @classmethod
+    def resume(cls, p, checkpoint, table=None, profiler=None):
+        """Search on p, a new BranchAndBound of the same instance, from the
+        state saved in checkpoint"""
+        with open(checkpoint, "rb") as f:
+            state = pickle.load(f)
+        search = cls(p, state["sol"], state["best_cost"], state["stats"],
+                     table, profiler)
+        search.started = state["started"]
+        search.stack = state["stack"]
+        search.bounds = state["bounds"]
+        for move in state["path"]:
+            search.marks.append(p.mark())
+            p.apply(move)
+            search.path.append(move)
+        return search
+
+
+class BestFirst(Driver):
+    """Expands first the open state with the highest bound
+
+    The open states are kept in a priority queue as the moves that reach
+    them, and p is moved between them with goto(). When the best bound
+    in the queue cannot beat the incumbent, the incumbent is optimal.
+    """
+
+    def __init__(self, p, sol=None, best_cost=0, stats=None, table=None,
+                 profiler=None):
+        super().__init__(p, sol, best_cost, stats, table, profiler)
+        self.queue = []
+        self.tie = count()  # Keeps the order of insertion between ties
+        self.started = False
+
+    @property
+    def done(self):
+        return self.started and not self.queue
+
+    def upper(self):
+        if self.queue:
+            return max(self.best_cost, -self.queue[0][0])
+        return self.best_cost
+
+    def push(self):
+        bound = self.evaluate()
+        if bound is not None:
+            heapq.heappush(self.queue, (-bound, next(self.tie),
+                                        tuple(self.path)))
+            if self.profiler is not None:
+                self.profiler.frontier(len(self.queue))
+
+    def run(self, max_nodes=None, max_time=None):
+        temp = time()
+        self.paused = False
+        if not self.started:
+            self.started = True
+            self.push()
+        nodes = 0
+        while self.queue and not self.paused:
+            if max_nodes is not None and nodes >= max_nodes:
+                break
+            if max_time is not None and time() - temp >= max_time:
+                break
+            bound, _, path = self.queue[0]
+            if -bound <= self.best_cost:
+                # Nothing left can beat the incumbent
+                self.stats["pruned"] += len(self.queue)
+                self.queue.clear()
+                break
+            heapq.heappop(self.queue)
+            self.goto(path)
+            self.stats["expanded"] += 1
+            for move in self.p.moves():
+                self.goto(path + (move,))
+                nodes += 1
+                self.push()
+        self.goto(())
+        return self.sol, self.best_cost
+
+
+class Beam(Driver):
+    """Keeps only the width states with the highest bound at every depth
+
+    It is not exhaustive, so the best bound among the discarded states is
+    kept to report the gap.
+    """
+
+    def __init__(self, p, sol=None, best_cost=0, stats=None, table=None,
+                 profiler=None, width=10):
+        super().__init__(p, sol, best_cost, stats, table, profiler)
+        self.width = width
+        self.level = []  # (bound, path) of the states of the current depth
+        self.discarded = float("-inf")
+        self.started = False
+
+    @property
+    def done(self):
+        return self.started and not self.level
+
+    def upper(self):
+        return max([self.best_cost, self.discarded]
+                   + [bound for bound, path in self.level])
+
+    def run(self, max_nodes=None, max_time=None):
+        temp = time()
+        self.paused = False
+        if not self.started:
+            self.started = True
+            bound = self.evaluate()
+            if bound is not None:
+                self.level = [(bound, ())]
+        nodes = 0
+        while self.level and not self.paused:
+            children = []
+            stopped = False
+            while self.level:
+                if ((max_nodes is not None and nodes >= max_nodes) or
+                        (max_time is not None and time() - temp >= max_time)):
+                    stopped = True
+                    break
+                bound, path = self.level.pop()
+                if bound <= self.best_cost:
+                    self.stats["pruned"] += 1
+                    continue
+                self.goto(path)
+                self.stats["expanded"] += 1
+                for move in self.p.moves():
+                    self.goto(path + (move,))
+                    nodes += 1
+                    bound = self.evaluate()
+                    if bound is not None:
+                        children.append((bound, tuple(self.path)))
+                if self.profiler is not None:
+                    self.profiler.frontier(len(self.level) + len(children))
+            children.sort(key=lambda child: child[0], reverse=True)
+            if stopped:
+                # Nothing is discarded, run() can go on with this depth
+                self.level += children
+                break
+            for bound, path in children[self.width:]:
+                self.discarded = max(self.discarded, bound)
+            # Popped from the end, so the best state is expanded first
+            self.level = children[:self.width][::-1]
+        self.goto(())
+        return self.sol, self.best_cost
+
+
+STRATEGIES = {"depth": Search, "best": BestFirst, "beam": Beam}
+
+
+def solve(p, strategy="depth", max_nodes=None, max_time=None, **options):
+    """Runs one of STRATEGIES on p within the budget
+
+    Returns the best solution found, its cost and the proven gap to the
+    optimum, which is 0 when the tree was exhausted. options go to the
+    driver, for example the width of the beam.
+    """
+    driver = STRATEGIES[strategy](p, **options)
+    sol, cost = driver.run(max_nodes=max_nodes, max_time=max_time)
+    gap = driver.gap()
+    # Leave p at the root like it was given
+    if strategy == "depth":
+        driver.goto(())
+        driver.stack.clear()
+    return sol, cost, gap
+
+
+if __name__ == '__main__':
+    from gml import load_physical, load_request
+    from heuristic import warm_start
+    from instrument import Profiler
+    from paths import K, PathCatalogue
+    from distances import load
+    from reduction import reduce
+
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("network")
+    args.add_argument("request")
+    args.add_argument("--strategy", choices=STRATEGIES, default="depth")
+    args.add_argument("--width", type=int, default=10, help="of the beam")
+    args.add_argument("--checkpoint", default=None,
+                      help="file to save the depth first search to and "
+                           "resume it from")
+    args.add_argument("--every", type=float, default=60,
+                      help="seconds between checkpoints")
+    args.add_argument("--max-time", type=float, default=None)
+    args.add_argument("--max-nodes", type=int, default=None)
+    args.add_argument("--warm-start", action="store_true",
+                      help="seed the incumbent with the greedy heuristic")
+    args.add_argument("--paths", action="store_true",
+                      help="map every link in one step with a catalogue of "
+                           "simple paths")
+    args.add_argument("--k-paths", type=int, default=None,
+                      help="paths kept per pair of hosts, 0 for all, "
+                           "paths.K by default")
+    args.add_argument("--max-hops", type=int, default=None,
+                      help="longest path of the catalogue")
+    args.add_argument("--reduce", action="store_true",
+                      help="remove the nodes and edges the request cannot "
+                           "use before the search")
+    args.add_argument("--delay", action="store_true",
+                      help="keep the distance of every path within the "
+                           "delay of its link")
+    args.add_argument("--lp", action="store_true",
+                      help="bound with the linear relaxation too, needs "
+                           "highspy")
+    args.add_argument("--lp-depth", type=int, default=None,
+                      help="deepest state where the relaxation is solved")
+    args.add_argument("--lp-margin", type=float, default=0.05,
+                      help="relative distance to the incumbent within "
+                           "which the relaxation is solved")
+    args.add_argument("--table", type=int, default=None,
+                      help="size of a transposition table, none by default")
+    args.add_argument("--report", default=None,
+                      help="file to append JSON lines with the counters "
+                           "and timers of the search to")
+    args.add_argument("--report-every", type=float, default=None,
+                      help="seconds between reports, only the last one "
+                           "by default")
+    args = args.parse_args()
+    physical = load_physical(args.network)
+    requests = load_request(args.request)
+    num_links = None
+    if args.reduce:
+        reduction = reduce(physical, requests)
+        print(f'|reduction|{json.dumps(reduction.stats())}|')
+        physical, num_links = reduction.physical, reduction.num_links
+    distances = load(physical) if args.delay else None
+    paths = None
+    if (args.paths or args.k_paths is not None
+            or args.max_hops is not None):
+        k = K if args.k_paths is None else args.k_paths or None
+        paths = PathCatalogue(physical, k=k, max_hops=args.max_hops,
+                              distances=distances)
+    p = BranchAndBound(physical, requests, paths=paths, num_links=num_links,
+                       distances=distances)
+    sol, cost = warm_start(p) if args.warm_start else (None, 0)
+    table = None if args.table is None else TranspositionTable(args.table)
+    profiler = None
+    if args.report:
+        profiler = Profiler(output=args.report, every=args.report_every)
+    options = dict()
+    if args.strategy == "depth":
+        if args.checkpoint and os.path.exists(args.checkpoint):
+            search = Search.resume(p, args.checkpoint, table, profiler)
+        else:
+            search = Search(p, sol, cost, table=table, profiler=profiler)
+        options = dict(checkpoint=args.checkpoint, every=args.every)
+    elif args.strategy == "beam":
+        search = Beam(p, sol, cost, table=table, profiler=profiler,
+                      width=args.width)
+    else:
+        search = STRATEGIES[args.strategy](p, sol, cost, table=table,
+                                           profiler=profiler)
+    relaxation = None
+    if args.lp:
+        from relaxation import LPBound
+        relaxation = LPBound(p, max_depth=args.lp_depth, margin=args.lp_margin)
+        relaxation.attach(incumbent=lambda: search.best_cost)
+    # Batch schedulers send SIGTERM before killing a preempted job
+    signal.signal(signal.SIGTERM, lambda signum, frame: search.pause())
+    signal.signal(signal.SIGINT, lambda signum, frame: search.pause())
+    temp = time()
+    sol, cost = search.run(max_nodes=args.max_nodes, max_time=args.max_time,
+                           **options)
+    status = "done" if search.done else "paused"
+    print(f'|{args.request}|{args.network}|{status}|{cost}|{search.gap()}|'
+          f'{time() - temp}|{search.stats["expanded"]}|'
+          f'{search.stats["pruned"]}|{search.stats["leaves"]}|')
+    if table is not None:
+        print(f'|table|{json.dumps(table.stats())}|')
+    if relaxation is not None:
+        print(f'|lp|{json.dumps(relaxation.report(cost))}|')
+    if profiler is not None:
+        profiler.close(p)
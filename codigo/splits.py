@@ -0,0 +1,329 @@
+# coding: utf-8
+"""Functional split tables of confData/datos.xlsx
+
+For every split level, from C-RAN (everything but the radio in the
+central unit) to RRC/PDCP (everything but the RRC in the distributed
+unit), the first sheet of the workbook has two blocks: the central unit
+cluster and the distributed unit. Each has the computational complexity
+(GOPS), the latency (ms) and the traffic rate (packets per second and
+Mbps) for 6, 15, 25, 50, 75 and 100 PRBs.
+
+The workbook is read with zipfile and ElementTree, taking the values
+cached by the spreadsheet for the formulas, and the GOPS and Mbps are
+compiled into a SplitTable of flat arrays. The latency is left out: its
+milliseconds have no common unit with the distances of the networks, so
+the delays of the links are the ones of the requests. The table is kept
+in the cache folder, in the format of cache.py and a file named by the
+SHA-256 of the workbook, so later loads only read the arrays.
+
+With a split level for every distributed unit, split_requests() turns
+the table into demands:
+
+- a distributed unit needs the GOPS of its level in the DU block,
+- a central unit needs the sum of the GOPS of the CU block of the levels
+  of the distributed units linked to it,
+- a link with a distributed unit needs the Mbps of its level and PRBs in
+  the DU block, the largest one if both ends are distributed units.
+
+The PRBs of a node are rounded up to the next column of the table.
+best_split() chooses the level of every distributed unit, one after the
+other, cutting the choices that cannot beat the best embedding found.
+"""
+import hashlib
+import json
+import os
+import re
+import zipfile
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import replace
+from time import time
+from xml.etree import ElementTree
+
+from representation import *
+import cache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                    "confData", "datos.xlsx")
+MAGIC = b"LFS3"
+LEVELS = ["C-RAN", "Intra-PHY", "MAC/PHY", "Intra-MAC", "RLC/MAC",
+          "Intra-RLC", "PDCP/RLC", "RRC/PDCP"]
+SIDES = ["cu", "du"]  # Blocks of the sheet, in order
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+def cell_position(ref):
+    """(row, column) from 1 of a cell reference like "AB12\""""
+    letters, row = re.fullmatch(r"([A-Z]+)(\d+)", ref).groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return int(row), column
+
+
+def read_xlsx(path):
+    """Sheet name -> {(row, column): value} with the values of the cells"""
+    with zipfile.ZipFile(path) as book:
+        strings = []
+        if "xl/sharedStrings.xml" in book.namelist():
+            root = ElementTree.fromstring(book.read("xl/sharedStrings.xml"))
+            strings = ["".join(text.text or "" for text in item.iter(_NS + "t"))
+                       for item in root.iter(_NS + "si")]
+        rels = ElementTree.fromstring(book.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+        workbook = ElementTree.fromstring(book.read("xl/workbook.xml"))
+        sheets = dict()
+        for sheet in workbook.iter(_NS + "sheet"):
+            target = targets[sheet.get(_REL + "id")].lstrip("/")
+            if not target.startswith("xl/"):
+                target = "xl/" + target
+            cells = dict()
+            for cell in ElementTree.fromstring(book.read(target)).iter(_NS + "c"):
+                value = cell.find(_NS + "v")
+                if value is None or value.text is None:
+                    continue
+                if cell.get("t") == "s":
+                    value = strings[int(value.text)]
+                elif cell.get("t") in ("str", "inlineStr", "e"):
+                    value = value.text
+                else:
+                    value = float(value.text)
+                cells[cell_position(cell.get("r"))] = value
+            sheets[sheet.get("name")] = cells
+    return sheets
+
+
+class SplitTable:
+    """Demands of every split level as flat arrays
+
+    For the side s ("cu" or "du") and the level i, gops[s][i] is its GOPS
+    and rate[s][i * len(prbs) + j] its Mbps with prbs[j] PRBs. column[n]
+    is the column of a node with n PRBs, the first one with at least n.
+    """
+
+    def __init__(self, prbs, gops, rate):
+        self.prbs = array('q', prbs)
+        self.gops, self.rate = gops, rate
+        self.column = array('q', [0] * (self.prbs[-1] + 1))
+        j = 0
+        for n in range(len(self.column)):
+            while self.prbs[j] < n:
+                j += 1
+            self.column[n] = j
+
+    def prc(self, level, side="du"):
+        return self.gops[side][level]
+
+    def bandwith(self, level, prb, side="du"):
+        column = self.column[min(prb, len(self.column) - 1)]
+        return self.rate[side][level * len(self.prbs) + column]
+
+    @classmethod
+    def from_sheet(cls, cells):
+        """Table of the blocks of the sheet, found by their headers"""
+        rows = defaultdict(list)  # Level -> rows of the blocks, in order
+        for (row, column), value in sorted(cells.items()):
+            if column == 1 and value in LEVELS:
+                rows[value].append(row)
+        if (sorted(rows) != sorted(LEVELS)
+                or any(len(found) != len(SIDES) for found in rows.values())):
+            raise Exception("Not a sheet of split levels")
+        gops, rate = dict(), dict()
+        prbs = None
+        for number, side in enumerate(SIDES):
+            first = min(rows[level][number] for level in LEVELS)
+            # Two rows of headers over every block
+            titles = {column: value for (row, column), value in cells.items()
+                      if row == first - 2}
+            labels = {column: int(re.match(r"\d+", value).group())
+                      for (row, column), value in cells.items()
+                      if row == first - 1 and isinstance(value, str)
+                      and re.fullmatch(r"\d+ ?PRBs", value)}
+            start = next(column for column, value in titles.items()
+                         if value.startswith("Traffic rate (Mbps)"))
+            columns = sorted(column for column in labels if column >= start)
+            found = [labels[column] for column in columns]
+            if prbs is not None and found != prbs:
+                raise Exception("Blocks with different PRBs")
+            prbs = found
+            gops[side] = array('d', [cells[rows[level][number], 2]
+                                     for level in LEVELS])
+            rate[side] = array('d', [cells[rows[level][number], column]
+                                     for level in LEVELS
+                                     for column in columns])
+        return cls(prbs, gops, rate)
+
+    def dumps(self):
+        columns = {"prbs": self.prbs}
+        for side in SIDES:
+            columns[f"gops_{side}"] = self.gops[side]
+            columns[f"rate_{side}"] = self.rate[side]
+        return cache.pack(MAGIC, {}, columns)
+
+    @classmethod
+    def loads(cls, buffer):
+        columns = cache.unpack(buffer, MAGIC)[1]
+        return cls(columns["prbs"],
+                   *({side: columns[f"{name}_{side}"] for side in SIDES}
+                     for name in ("gops", "rate")))
+
+
+def load(path=DATA, cache_dir=cache.CACHE_DIR):
+    """SplitTable of the first sheet of the workbook in path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    name = None
+    if cache_dir is not None:
+        name = os.path.join(cache_dir,
+                            hashlib.sha256(MAGIC + data).hexdigest() + ".split")
+        if os.path.exists(name):
+            with open(name, 'rb') as f:
+                return SplitTable.loads(f.read())
+    sheets = read_xlsx(path)
+    table = SplitTable.from_sheet(next(iter(sheets.values())))
+    if name is not None:
+        cache.write(name, table.dumps())
+    return table
+
+
+def split_requests(requests, table, levels):
+    """Copy of requests with the demands of levels, a dict from the id of
+    every distributed unit to its level or to a list of levels, which
+    gives the smallest demands of any of them"""
+
+    def smallest(demand, level):
+        if isinstance(level, int):
+            return demand(level)
+        return min(demand(i) for i in level)
+
+    nodes = {node.id: node for node in requests.get_nodes()}
+    central = defaultdict(float)  # Central unit id -> GOPS
+    linked = set()
+    for link in requests.get_edges():
+        for end, other in ((link.source, link.target),
+                           (link.target, link.source)):
+            if end in levels and isinstance(nodes[other], CentralUnit):
+                central[other] += smallest(lambda i: table.prc(i, "cu"),
+                                           levels[end])
+                linked.add(other)
+    elements = defaultdict(list)
+    for node in requests.get_nodes():
+        if node.id in levels:
+            node = replace(node, prc=smallest(table.prc, levels[node.id]))
+        elif node.id in linked:
+            node = replace(node, prc=central[node.id])
+        elements['nodes'].append(node)
+    for link in requests.get_edges():
+        rates = [smallest(lambda i: table.bandwith(i, nodes[end].prb),
+                          levels[end])
+                 for end in (link.source, link.target) if end in levels]
+        if rates:
+            link = replace(link, bandwith=max(rates))
+        elements['edges'].append(link)
+    return Topology(elements)
+
+
+def best_split(physical, requests, table, levels=range(len(LEVELS)),
+               max_nodes=None, max_time=None, stats=None):
+    """Best embedding over the levels of every distributed unit
+
+    The levels are chosen depth first, one distributed unit after the
+    other. Every choice is searched with the units left at the smallest
+    demands of their levels, which any choice for them only raises, so
+    no completion of the choice beats the best cost of that search. The
+    choices whose search cannot beat the best embedding found are cut,
+    and the levels of a unit are tried from the highest bound. Every
+    search is depth first, with the best cost as incumbent and at most
+    max_nodes states, until max_time seconds in total. Returns the dict
+    of levels, the solution and its cost, or None, None and 0, also when
+    a unit fits in no host at any level.
+    """
+    from search import Search
+
+    if stats is None:
+        stats = Counter()
+    units = [node for node in requests.get_nodes()
+             if isinstance(node, DistributedUnit)]
+    hosts = [node for node in physical.get_nodes()
+             if isinstance(node, DistributedUnit)]
+    # Levels whose GOPS fit in some host of every unit
+    choices = {unit.id: [level for level in levels
+                         if any(fits(replace(unit, prc=table.prc(level)), host)
+                                for host in hosts)]
+               for unit in units}
+    if not all(choices.values()):
+        return None, None, 0
+    # The demands are GOPS and Mbps, so the capacities are floats, and
+    # every search leaves the residual network as it was
+    residual = ResidualNetwork.from_topology(physical, 'd')
+    classes = host_classes(physical)
+    best = [None, None, 0]
+    deadline = None if max_time is None else time() + max_time
+
+    def bound(chosen):
+        """Best cost of the completions of chosen that beat the best
+        embedding, or a bound on it if the search stops early"""
+        p = BranchAndBound(physical,
+                           split_requests(requests, table,
+                                          {**choices, **chosen}),
+                           residual=residual, classes=classes)
+        left = None if deadline is None else max(0, deadline - time())
+        search = Search(p, None, best[2], stats)
+        sol, cost = search.run(max_nodes=max_nodes, max_time=left)
+        search.goto(())
+        stats["split_searches"] += 1
+        if len(chosen) == len(units) and sol is not None and cost > best[2]:
+            best[:] = [dict(chosen), sol, cost]
+        return search.upper()
+
+    def branch(chosen):
+        unit = units[len(chosen)]
+        children = []
+        for level in choices[unit.id]:
+            if deadline is not None and time() >= deadline:
+                return
+            child = {**chosen, unit.id: level}
+            children.append((bound(child), child))
+        if len(chosen) + 1 == len(units):
+            return
+        children.sort(key=lambda child: -child[0])
+        for upper, child in children:
+            if upper <= best[2]:
+                stats["split_pruned"] += 1
+                continue
+            branch(child)
+
+    if units:
+        branch(dict())
+    else:
+        bound(dict())
+    return tuple(best)
+
+
+if __name__ == '__main__':
+    import argparse
+    from gml import load_physical, load_request
+
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument("network", nargs="?")
+    args.add_argument("request", nargs="?")
+    args.add_argument("--data", default=DATA)
+    args.add_argument("--max-nodes", type=int, default=None,
+                      help="states of every search of best_split()")
+    args.add_argument("--max-time", type=float, default=None)
+    args = args.parse_args()
+    table = load(args.data)
+    for level, name in enumerate(LEVELS):
+        print(f'|{name}|{table.prc(level, "cu")}|{table.prc(level)}|'
+              + '|'.join(str(table.bandwith(level, prb))
+                         for prb in table.prbs) + '|')
+    if args.request:
+        temp = time()
+        levels, sol, cost = best_split(load_physical(args.network),
+                                       load_request(args.request), table,
+                                       max_nodes=args.max_nodes,
+                                       max_time=args.max_time)
+        levels = {id: LEVELS[level] for id, level in (levels or {}).items()}
+        print(f'|{args.request}|{args.network}|{cost}|{time() - temp}|'
+              f'{json.dumps(levels)}|')
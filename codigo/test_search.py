@@ -0,0 +1,599 @@
+# coding: utf-8
+"""Checks of BranchAndBound, run with pytest from this folder
+
+Every combination of the options of the search is compared with a brute
+force enumeration of all the embeddings of a few small instances.
+"""
+import os
+from functools import lru_cache
+
+import pytest
+
+from BB import *
+from distances import DistanceMatrix
+from paths import PathCatalogue
+from reduction import reduce
+from search import Search, BestFirst, Beam
+
+DIR = os.path.join(os.path.dirname(__file__), "..", "instances")
+PAIRS = [("DU2CU1/Gn3e2.gml", "R1CUs1DUs2E2/R1n3e2.gml"),
+         ("DU2CU1/Gn4e4.gml", "R1CUs1DUs2E2/R1n3e2.gml"),
+         ("DU2CU1/Gn5e7.gml", "R1CUs1DUs2E2/R1n3e2.gml"),
+         ("DU3CU2/Gn5e7.gml", "R2CUs1DUs2E2/R2n3e2.gml"),
+         ("DU3CU2/Gn5e7.gml", "R3CUs3DUs3E3/R2n3e2.gml"),
+         ("DU2CU1/Gn6e9.gml", "R1CUs1DUs2E2/R1n3e2.gml")]
+TIGHT = 120  # Delay of the links of the copies with tight delays
+DRIVERS = ["start", "depth", "best", "beam"]
+
+
+def physical(nodes, edges):
+    """Topology with an edge in both directions for every
+    (source, target, bandwith, distance) in edges"""
+    elements = defaultdict(list)
+    elements['nodes'] = list(nodes)
+    for source, target, bandwith, distance in edges:
+        elements['edges'] += [EdgePhysical(source, target, bandwith, distance, 0),
+                              EdgePhysical(target, source, bandwith, distance, 0)]
+    return Topology(elements)
+
+
+def request(nodes, links):
+    elements = defaultdict(list)
+    elements['nodes'] = list(nodes)
+    elements['edges'] = [EdgeVirtual(*link) for link in links]
+    return Topology(elements)
+
+
+def twins():
+    """DU1 and DU2 are equal but for the distance of their edge to CU0"""
+    network = physical([CentralUnit(0, "cu", 0, 0, 100),
+                        DistributedUnit(1, "du", 0, 0, 100, 100, 100, 0),
+                        DistributedUnit(2, "du", 0, 0, 100, 100, 100, 0)],
+                       [(0, 1, 100, 50), (0, 2, 100, 5)])
+    demand = request([CentralUnit(0, "cu", 0, 0, 10),
+                      DistributedUnit(1, "du", 0, 0, 10, 10, 10, 0)],
+                     [(0, 1, 10, 10)])
+    return network, demand
+
+
+def test_symmetry_with_delays():
+    network, demand = twins()
+    distances = DistanceMatrix.from_topology(network)
+    for symmetry in (True, False):
+        p = BranchAndBound(network, demand, symmetry=symmetry,
+                           distances=distances)
+        sol, cost = start(p)
+        assert abs(cost - 0.975) < 1e-12
+        assert sol.node_correspondance[demand.get_node_by_id(1)].id == 2
+
+
+def instances():
+    """(name, network, request) of the shipped pairs, each also with
+    tight delays, and of twins()"""
+    from gml import load_physical, load_request
+
+    result = [("twins",) + twins()]
+    for net, req in PAIRS:
+        network = load_physical(os.path.join(DIR, "networks", "small", net))
+        demand = load_request(os.path.join(DIR, "requests", "small", req))
+        tight = request(demand.get_nodes(),
+                        [(link.source, link.target, link.bandwith, TIGHT)
+                         for link in demand.get_edges()])
+        result += [(f"{net}-{req}", network, demand),
+                   (f"{net}-{req}-tight", network, tight)]
+    return result
+
+
+def simple_paths(network, residual, source, target, bandwith, delay):
+    """Paths from source to target, as lists of edges, with bandwith left
+    in every edge and at most delay of distance, None for no limit"""
+    paths = []
+    stack = [(source, [], {source}, 0)]
+    while stack:
+        node, path, visited, length = stack.pop()
+        if node == target and path:
+            paths.append(path)
+            continue
+        for edge in network.get_edge_by_source(node):
+            if (edge.target in visited or residual[edge] < bandwith
+                    or (delay is not None
+                        and length + edge.distance > delay)):
+                continue
+            stack.append((edge.target, path + [edge],
+                          visited | {edge.target}, length + edge.distance))
+    return paths
+
+
+def brute_force(network, demand, delays):
+    """Highest cost of all the embeddings of demand in network"""
+    nodes, links = demand.get_nodes(), demand.get_edges()
+    hosts = network.get_nodes()
+    num_links = len(network.get_edges())
+    pools = sum(1 for node in nodes if isinstance(node, CentralUnit))
+    best = 0
+    for placement in product(hosts, repeat=len(nodes)):
+        left = {host.id: [host.prc, getattr(host, "prb", 0),
+                          getattr(host, "ant", 0)] for host in hosts}
+        for node, host in zip(nodes, placement):
+            if not fits(node, host):
+                break
+            need = [node.prc, getattr(node, "prb", 0), getattr(node, "ant", 0)]
+            left[host.id] = [a - b for a, b in zip(left[host.id], need)]
+            if min(left[host.id]) < 0:
+                break
+        else:
+            where = {node.id: host.id for node, host in zip(nodes, placement)}
+            residual = {edge: edge.bandwith for edge in network.get_edges()}
+            best = max(best, route_all(network, links, where, residual,
+                                       delays, set(), pools, num_links))
+    return best
+
+
+def route_all(network, links, where, residual, delays, used, pools,
+              num_links):
+    if not links:
+        use = sum(1 - residual[edge] / edge.bandwith
+                  for edge in network.get_edges())
+        return len(used) / pools * (1 - use / num_links)
+    link, best = links[0], 0
+    for path in simple_paths(network, residual, where[link.source],
+                             where[link.target], link.bandwith,
+                             link.delay if delays else None):
+        for edge in path:
+            residual[edge] -= link.bandwith
+        best = max(best, route_all(network, links[1:], where, residual,
+                                   delays, used | set(path), pools,
+                                   num_links))
+        for edge in path:
+            residual[edge] += link.bandwith
+    return best
+
+
+def checked_cost(network, demand, solution, delays):
+    """Cost of solution from scratch, after checking it is an embedding"""
+    load = defaultdict(int)
+    for node, host in solution.node_correspondance.items():
+        assert fits(node, host)
+    for link, path in solution.edge_correspondance.items():
+        hosts = [solution.node_correspondance[demand.get_node_by_id(id)].id
+                 for id in (link.source, link.target)]
+        assert path[0].source == hosts[0] and path[-1].target == hosts[1]
+        assert all(a.target == b.source for a, b in zip(path, path[1:]))
+        if delays:
+            assert sum(edge.distance for edge in path) <= link.delay
+        for edge in path:
+            load[edge.source, edge.target] += link.bandwith
+    assert len(solution.edge_correspondance) == len(demand.get_edges())
+    use = 0
+    for edge in network.get_edges():
+        taken = load.get((edge.source, edge.target), 0)
+        assert taken <= edge.bandwith
+        use += taken / edge.bandwith
+    pools = sum(1 for host in solution.node_correspondance.values()
+                if isinstance(host, CentralUnit))
+    return len(load) / pools * (1 - use / len(network.get_edges()))
+
+
+@lru_cache(maxsize=None)
+def expected():
+    return {(name, delays): brute_force(network, demand, delays)
+            for name, network, demand in instances()
+            for delays in (False, True)}
+
+
+def run(driver, p, table):
+    if driver == "start":
+        return start(p, table=table)
+    if driver == "depth":
+        return Search(p, table=table).run()
+    if driver == "best":
+        return BestFirst(p, table=table).run()
+    return Beam(p, table=table, width=1 << 30).run()
+
+
+@pytest.mark.parametrize("driver", DRIVERS)
+@pytest.mark.parametrize("symmetry, paths, table, reduced, delays",
+                         list(product((False, True), repeat=5)))
+def test_brute_force(driver, symmetry, paths, table, reduced, delays):
+    for name, network, demand in instances():
+        physical, num_links = network, None
+        if reduced:
+            reduction = reduce(network, demand)
+            physical, num_links = reduction.physical, reduction.num_links
+        distances = DistanceMatrix.from_topology(physical) if delays else None
+        catalogue = (PathCatalogue(physical, k=None, distances=distances)
+                     if paths else None)
+        p = BranchAndBound(physical, demand, paths=catalogue,
+                           symmetry=symmetry, num_links=num_links,
+                           distances=distances)
+        sol, cost = run(driver, p,
+                        TranspositionTable() if table else None)
+        assert abs(cost - expected()[name, delays]) < 1e-9, name
+        assert not p.trail
+        if sol is not None:
+            if reduced:
+                sol = reduction.restore(sol)
+            assert abs(checked_cost(network, demand, sol, delays) - cost) < 1e-9
+
+
+def test_parallel():
+    for name, network, demand in instances()[:3]:
+        sol, cost = parallel_start(network, demand, processes=2)
+        assert abs(cost - expected()[name, False]) < 1e-9, name
+
+
+def test_partial_path_is_not_assigned():
+    """A link is assigned when its path reaches the host of its target,
+    not after its first hop, which gave 2.747 on this pair"""
+    from gml import load_physical, load_request
+
+    network = load_physical(os.path.join(DIR, "networks", "small",
+                                         PAIRS[0][0]), 0)
+    demand = load_request(os.path.join(DIR, "requests", "small",
+                                       PAIRS[0][1]), 0)
+    p = BranchAndBound(network, demand)
+    # The path of the link 0 -> 1 from the host 2 to the host 1 is 2, 0, 1
+    for move in [('node', 0, 2), ('node', 1, 1), ('node', 2, 0),
+                 ('link', 0, 1, 2, 0)]:
+        p.apply(move)
+    assert not p.is_assigned()
+    p.apply(('link', 0, 1, 0, 1))
+    p.apply(('link', 0, 2, 2, 0))
+    assert p.is_assigned()
+    p.undo(0)
+    sol, cost = start(p)
+    assert cost == pytest.approx(1.8313651988196042, abs=1e-12)
+
+
+def test_relaxation():
+    pytest.importorskip("highspy")
+    from relaxation import LPBound
+
+    for name, network, demand in instances():
+        p = BranchAndBound(network, demand)
+        relaxation = LPBound(p, margin=float("inf"))
+        relaxation.attach()
+        sol, cost = start(p)
+        assert abs(cost - expected()[name, False]) < 1e-9, name
+
+
+def test_relaxation_default():
+    """Without an incumbent the relaxation is solved in every state"""
+    pytest.importorskip("highspy")
+    from relaxation import LPBound
+
+    for name, network, demand in instances():
+        p = BranchAndBound(network, demand)
+        relaxation = LPBound(p)
+        relaxation.attach()
+        sol, cost = start(p)
+        assert abs(cost - expected()[name, False]) < 1e-9, name
+        report = relaxation.report(cost)
+        if p.num_pools and p.num_links:
+            assert report["solves"] and not report.get("skipped")
+            assert report["root"] is not None
+
+
+def test_decompose():
+    """The groups of R2n6e3 give 0.953 alone, the search of the whole
+    request from them the optimum"""
+    from decompose import solve
+    from gml import load_physical, load_request
+
+    for name, network, demand in instances()[:4]:
+        sol, cost, gap, report = solve(network, demand)
+        assert abs(cost - expected()[name, False]) < 1e-9, name
+        assert gap == 0
+    network = load_physical(os.path.join(DIR, "networks", "small", "DU3CU3",
+                                         "Gn8e10.gml"))
+    demand = load_request(os.path.join(DIR, "requests", "small",
+                                       "R2CUs3DUs3E3", "R2n6e3.gml"))
+    sol, cost, gap, report = solve(network, demand)
+    assert len(report) == 3 and gap == 0
+    assert cost == pytest.approx(2.528595234135377, abs=1e-9)
+    assert abs(checked_cost(network, demand, sol, False) - cost) < 1e-9
+
+
+def test_decompose_without_links():
+    """A central unit without links costs 0 alone, which is not the same
+    as no embedding"""
+    from decompose import solve
+
+    network, demand = twins()
+    demand = request(demand.get_nodes() + [CentralUnit(2, "cu", 0, 0, 10)],
+                     [(0, 1, 10, 10)])
+    best = brute_force(network, demand, False)
+    assert best > 0
+    sol, cost, gap, report = solve(network, demand)
+    assert abs(cost - best) < 1e-9 and gap == 0
+    assert abs(checked_cost(network, demand, sol, False) - cost) < 1e-9
+
+
+def test_decompose_budget():
+    """max_nodes bounds every search, and the gap says the result is not
+    proven"""
+    from decompose import initial_groups, solve
+    from gml import load_physical, load_request
+
+    network = load_physical(os.path.join(DIR, "networks", "small", "DU3CU3",
+                                         "Gn10e12.gml"))
+    demand = load_request(os.path.join(DIR, "requests", "small",
+                                       "R3CUs3DUs3E3", "R3n6e3.gml"))
+    stats = Counter()
+    sol, cost, gap, report = solve(network, demand, max_nodes=200,
+                                   stats=stats)
+    # Every group is searched once alone or joined, and then the request
+    searches = 2 * len(initial_groups(demand))
+    assert stats["expanded"] <= searches * 201
+    assert sol is not None and gap > 0
+
+
+def shipped_files():
+    """(kind, path) of the files of PAIRS"""
+    files = set()
+    for net, req in PAIRS:
+        files.add(("networks", os.path.join(DIR, "networks", "small", net)))
+        files.add(("requests", os.path.join(DIR, "requests", "small", req)))
+    return sorted(files)
+
+
+def same_topology(a, b):
+    from dataclasses import astuple
+
+    for attr in ("get_nodes", "get_edges"):
+        assert ([astuple(i) for i in getattr(a, attr)()] ==
+                [astuple(i) for i in getattr(b, attr)()])
+
+
+def test_cache(tmp_path):
+    """The topologies read from the cache are the ones parsed, in the
+    first load and in the later ones"""
+    import cache
+    import gml
+
+    for kind, path in shipped_files():
+        parse = gml.load_physical if kind == "networks" else gml.load_request
+        load = cache.load_physical if kind == "networks" else cache.load_request
+        for shift in (0, 1):
+            for step in ("cold", "warm"):
+                same_topology(parse(path, shift),
+                              load(path, shift, cache_dir=str(tmp_path)))
+    assert len(os.listdir(tmp_path)) == 2 * len(shipped_files())
+
+
+def test_gml_matches_sly():
+    """The regex loader of gml.py gives the topologies of the sly parsers
+    on the sample of its __main__"""
+    pytest.importorskip("sly")
+    import gml
+    from parser import load, PhysicalParser, RequestParser
+
+    for kind, path in gml.sample_files(DIR, 10):
+        fast = gml.load_physical if kind == "networks" else gml.load_request
+        slow = PhysicalParser if kind == "networks" else RequestParser
+        same_topology(load(path, slow, 1), fast(path, 1))
+
+
+def test_online():
+    """The first request gets the optimum of the empty network, the later
+    ones the capacity left, and commit() with sign -1 gives it back"""
+    from online import Online, commit
+
+    name, network, demand = instances()[7]
+    online = Online(network)
+    first = online.embed(demand)
+    assert first["accepted"] and first["exhausted"]
+    assert abs(first["cost"] - expected()[name, False]) < 1e-9
+    residual = online.residual
+    full = ResidualNetwork.from_topology(network, 'd')
+    assert list(residual.prc) != list(full.prc)
+    for _ in range(3):
+        online.embed(demand)
+    report = online.report()
+    assert report["requests"] == 4 and report["accepted"] == len(online.accepted)
+    for attr in ("prc", "prb", "ant", "bandwith"):
+        assert min(getattr(residual, attr)) >= 0, attr
+    for sol in online.accepted:
+        checked_cost(network, demand, sol, False)
+        commit(residual, sol, -1)
+    for attr in ("prc", "prb", "ant", "bandwith"):
+        assert list(getattr(residual, attr)) == pytest.approx(
+            list(getattr(full, attr))), attr
+
+
+def test_lns():
+    """step() keeps the incumbent an embedding that never gets worse and
+    leaves p at its root"""
+    from lns import LNS
+
+    improvements = 0
+    for name, network, demand in instances():
+        p = BranchAndBound(network, demand)
+        lns = LNS(p, seed=1, budget=200)
+        sol, cost = lns.initial()
+        if sol is None:
+            assert expected()[name, False] == 0, name
+            continue
+        for _ in range(20):
+            improved = lns.step()
+            assert (lns.cost > cost) == improved, name
+            improvements += improved
+            sol, cost = lns.sol, lns.cost
+            assert not p.trail
+        assert cost <= expected()[name, False] + 1e-9, name
+        assert abs(checked_cost(network, demand, sol, False) - cost) < 1e-9
+        assert [point[2] for point in lns.curve] == sorted(
+            point[2] for point in lns.curve)
+    assert improvements
+
+
+@pytest.mark.parametrize("name", ["results.jsonl", "results.csv"])
+def test_batch_resume(tmp_path, name):
+    """A run after a crash that left half a line writes its results on
+    lines of their own"""
+    import csv
+    import json
+    import shutil
+    from batch import FIELDS, run
+
+    net, req = PAIRS[0]
+    for kind, path in (("networks", net), ("requests", req)):
+        os.makedirs(tmp_path / kind / "small")
+        shutil.copy(os.path.join(DIR, kind, "small", path),
+                    tmp_path / kind / "small")
+    output = str(tmp_path / name)
+    with open(output, "w", newline="") as f:
+        if name.endswith(".csv"):
+            f.write(",".join(FIELDS) + "\r\n")
+        f.write('{"network": "net' if name.endswith(".jsonl") else "net")
+    run(str(tmp_path), ["small"], output, timeout=0, processes=1,
+        cache_dir="")
+
+    def rows():
+        with open(output, newline="") as f:
+            if name.endswith(".csv"):
+                return list(csv.DictReader(f))
+            return [json.loads(line) for line in f]
+
+    assert [row["status"] for row in rows()] == ["timeout"]
+    # The pair is done, so a second run adds nothing
+    run(str(tmp_path), ["small"], output, processes=1, cache_dir="")
+    assert len(rows()) == 1
+    os.remove(output)
+    run(str(tmp_path), ["small"], output, timeout=60, processes=1,
+        cache_dir="")
+    [row] = rows()
+    assert row["status"] == "ok"
+    assert abs(float(row["cost"]) - expected()[f"{net}-{req}", False]) < 1e-9
+
+
+def test_checkpoint(tmp_path):
+    """A search stopped, saved and resumed on a new BranchAndBound ends
+    like one that was never stopped"""
+    checkpoint = str(tmp_path / "search.pkl")
+    stopped = 0
+    for name, network, demand in instances():
+        whole = Search(BranchAndBound(network, demand))
+        sol, cost = whole.run()
+        first = Search(BranchAndBound(network, demand))
+        first.run(max_nodes=20, checkpoint=checkpoint)
+        if first.done:
+            continue
+        stopped += 1
+        p = BranchAndBound(network, demand)
+        resumed = Search.resume(p, checkpoint)
+        assert resumed.path == first.path
+        for _ in range(100):
+            resumed.run(max_nodes=7, checkpoint=checkpoint)
+            if resumed.done:
+                break
+            resumed = Search.resume(BranchAndBound(network, demand),
+                                    checkpoint)
+        assert resumed.done, name
+        assert abs(resumed.best_cost - cost) < 1e-9, name
+        for key in ("expanded", "pruned", "leaves", "infeasible"):
+            assert resumed.stats[key] == whole.stats[key], (name, key)
+    assert stopped
+
+
+def test_profiler(tmp_path):
+    """The profiler counts every expanded state at its depth, times each
+    step apart and writes its reports as JSON lines"""
+    import json
+    from instrument import Profiler
+
+    name, network, demand = instances()[7]
+    output = str(tmp_path / "profile.jsonl")
+    p = BranchAndBound(network, demand)
+    profiler = Profiler(output=output, every=0)
+    search = Search(p, profiler=profiler)
+    sol, cost = search.run()
+    assert abs(cost - expected()[name, False]) < 1e-9
+    report = profiler.close(p)
+    depths = report["expanded_by_depth"]
+    assert depths[0] == 1
+    assert sum(depths.values()) == search.stats["expanded"]
+    assert max(depths) < report["max_depth"] + 1
+    for timer in ("node", "link", "moves", "undo", "cost", "bound"):
+        assert report["times"][timer] > 0, timer
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) > 1
+    assert [line["elapsed"] for line in lines] == sorted(
+        line["elapsed"] for line in lines)
+    last = lines[-1]
+    assert last["stats"]["expanded"] == search.stats["expanded"]
+    assert {int(depth): count for depth, count
+            in last["expanded_by_depth"].items()} == depths
+    assert "bound" not in p.__dict__
+
+
+def test_benchmark_compare():
+    """compare() reports slower steps, more peak memory and another cost,
+    but not the differences within NOISE and MEMORY_NOISE"""
+    from benchmark import MEMORY_NOISE, NOISE, compare
+
+    old = dict(network="n", request="r", parse=0.1, setup=0.1, search=1.0,
+               cost=2.5, peak_rss=100000)
+    assert compare([dict(old)], [old]) == []
+    # Relatively large but under the noise floors
+    small = dict(old, parse=0.0001, setup=0.1, search=1.0,
+                 peak_rss=2 * MEMORY_NOISE // 3)
+    assert compare([dict(small, parse=0.0001 + NOISE / 2,
+                         peak_rss=MEMORY_NOISE)], [small]) == []
+    assert compare([dict(old, search=1.2, peak_rss=105000)], [old]) == []
+    regressions = compare([dict(old, search=1.5)], [old])
+    assert len(regressions) == 1 and "search" in regressions[0]
+    regressions = compare([dict(old, peak_rss=120000)], [old])
+    assert len(regressions) == 1 and "peak_rss" in regressions[0]
+    regressions = compare([dict(old, cost=2.4)], [old])
+    assert len(regressions) == 1 and "cost" in regressions[0]
+    assert compare([dict(old, network="other", search=9)], [old]) == []
+
+
+@pytest.mark.parametrize("delays", [False, True])
+def test_greedy(delays):
+    """Every route of the heuristic gives an embedding, with the cost
+    computed from scratch, that does not beat the optimum"""
+    from heuristic import ROUTES, greedy, warm_start
+
+    found = Counter()
+    for name, network, demand in instances():
+        distances = DistanceMatrix.from_topology(network) if delays else None
+        p = BranchAndBound(network, demand, distances=distances)
+        costs = []
+        for how in ROUTES:
+            sol, cost = greedy(p, how)
+            assert not p.trail
+            if sol is None:
+                assert cost == 0
+                continue
+            found[how] += 1
+            assert abs(checked_cost(network, demand, sol, delays)
+                       - cost) < 1e-9, (name, how)
+            assert cost <= expected()[name, delays] + 1e-9, (name, how)
+            costs.append(cost)
+        sol, cost = warm_start(p)
+        assert cost == max(costs, default=0)
+    assert set(found) == set(ROUTES)
+
+
+def test_cache_mixed_labels(tmp_path):
+    """A node without a string label gets a number from the gml loader,
+    and the cache keeps both kinds"""
+    import cache
+    import gml
+
+    path = str(tmp_path / "mixed.gml")
+    with open(path, "w") as f:
+        f.write('graph [\n'
+                '  node [ id 0 label "cu" type 2 prc 10 ]\n'
+                '  node [ id 1 type 1 prc 5 prb 6 ant 1 ]\n'
+                '  node [ id 2 label 7 type 1 prc 5 prb 6 ant 1 ]\n'
+                '  edge [ source 0 target 1 bandwith 3 delay 100 ]\n'
+                ']\n')
+    parsed = gml.load_request(path)
+    assert {type(node.label) for node in parsed.get_nodes()} == {str, int}
+    for step in ("cold", "warm"):
+        same_topology(parsed, cache.load_request(path,
+                                                 cache_dir=str(tmp_path)))